@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+def import_profile(top=10):
+    # Cumulative microseconds for main and for each module it imports directly,
+    # from python -X importtime
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'],
+                            cwd=os.path.dirname(MAIN), capture_output=True, text=True)
+    total, modules = 0, {}
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)', line)
+        if not match:
+            continue
+        if match.group(3) == 'main' and not match.group(2):
+            total = int(match.group(1))
+        elif len(match.group(2)) == 2:
+            modules[match.group(3)] = int(match.group(1))
+    return total, sorted(modules.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def run_once(timeout):
+    # perf_counter is a system wide monotonic clock on Windows and Linux, so the
+    # times main.py reports can be compared with the launch time taken here
+    fd, report = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    env = dict(os.environ, SLOTCAR_STARTUP_BENCHMARK=report)
+    try:
+        launched = time.perf_counter()
+        subprocess.run([sys.executable, MAIN], cwd=os.path.dirname(MAIN), env=env, timeout=timeout, check=False)
+        exited = time.perf_counter()
+        with open(report, 'r') as file:
+            times = json.load(file)
+    except (ValueError, OSError) as e:
+        raise RuntimeError(f"main.py did not report its startup times: {str(e)}")
+    finally:
+        os.remove(report)
+    return {
+        'imports': times['imports_done'] - launched,
+        'first_paint': times['first_paint'] - launched,
+        'warm': times['warm'] - launched,
+        'exit': exited - launched,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark: import time and time to first paint of main.py")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help="number of slowest imports to list")
+    parser.add_argument('--timeout', type=float, default=60, help="seconds to wait for one launch")
+    parser.add_argument('--max-first-paint-ms', type=float, help="fail if the median time to first paint exceeds this")
+    args = parser.parse_args()
+
+    total, modules = import_profile(args.top)
+    print(f"import main: {total / 1e3:.0f} ms")
+    for name, micros in modules:
+        print(f"  {name:<24} {micros / 1e3:7.1f} ms")
+
+    runs = []
+    for run in range(1, args.runs + 1):
+        times = run_once(args.timeout)
+        runs.append(times)
+        print(f"run {run}: imports {times['imports'] * 1e3:.0f} ms, first paint {times['first_paint'] * 1e3:.0f} ms, "
+              f"warm {times['warm'] * 1e3:.0f} ms")
+
+    # The first launch pays for a cold disk cache, so the median is the figure to track
+    first_paint = statistics.median(times['first_paint'] for times in runs)
+    print(f"median: imports {statistics.median(times['imports'] for times in runs) * 1e3:.0f} ms, "
+          f"first paint {first_paint * 1e3:.0f} ms, warm {statistics.median(times['warm'] for times in runs) * 1e3:.0f} ms")
+
+    if args.max_first_paint_ms is not None and first_paint > args.max_first_paint_ms / 1e3:
+        print("FAILED: first paint above threshold")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from serial_reader import start_marker
+from serial_sim import VirtualTrack, lap_script, load_script, expected_lap_times
+from race_control import RaceControl
+
+
+def run_once(script):
+    # Each run drives RaceControl.run_race in a scratch directory, so the
+    # journal and leaderboard it writes do not touch the real ones
+    laps = len(expected_lap_times(script))
+    track = VirtualTrack(script)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            control = RaceControl({'serial_port': track.port, 'timing_mode': 'host', 'lap_sensor': 'serial'})
+            recorded_ns = []
+            # The leaderboard change is the last thing run_race reports for a lap
+            control.listeners.append(lambda kind, data: recorded_ns.append(time.perf_counter_ns()) if kind == 'leaderboard' else None)
+            try:
+                control.get_serial_reader()
+                heat = control.new_heat({1: 'benchmark'}, laps)
+                start = start_marker()
+                heat.go(start)
+                cpu_start = time.process_time()
+                track.start(start.timestamp)
+                control.run_race(control.race_events, heat)
+                wall = (time.perf_counter_ns() - start.timestamp) / 1e9
+                track.wait(1)
+                # The virtual track busy-waits on its deadlines; that is the test rig, not the app
+                cpu = time.process_time() - cpu_start - track.cpu
+            finally:
+                control.close()
+                track.close()
+        finally:
+            os.chdir(cwd)
+
+    # The first crossing is not a lap, so lap i was triggered by the (i + 1)th line sent.
+    # The first lap runs from GO; its true time and every other one come from when
+    # the track actually sent each line, not from the script.
+    latencies = [(done - sent) / 1e3 for done, sent in zip(recorded_ns, track.sent_ns[1:])]
+    lap_starts = [start.timestamp] + track.sent_ns[1:-1]
+    truths = [(end - begin) / 1e9 for begin, end in zip(lap_starts, track.sent_ns[1:])]
+    errors = [abs(measured - truth) * 1e6 for measured, truth in zip(heat.counters[1].lap_times, truths)]
+    return latencies, errors, cpu, wall
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pulse-to-leaderboard latency benchmark of RaceControl against a virtual serial track")
+    parser.add_argument('--laps', type=int, default=20)
+    parser.add_argument('--lap-time', type=float, default=0.25, help="mean scripted lap time in seconds")
+    parser.add_argument('--jitter', type=float, default=0.05, help="random lap time variation in seconds")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--script', help="replay a recorded pulse stream instead of generated laps")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-latency-ms', type=float, help="fail if p95 pulse-to-leaderboard latency exceeds this")
+    parser.add_argument('--max-error-ms', type=float, help="fail if the worst lap time error exceeds this")
+    parser.add_argument('--max-cpu', type=float, help="fail if CPU use exceeds this fraction of a core")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    all_latencies, all_errors, cpu_shares = [], [], []
+    for run in range(1, args.runs + 1):
+        if args.script:
+            script = load_script(args.script)
+        else:
+            script = lap_script([args.lap_time + rng.uniform(-args.jitter, args.jitter) for _ in range(args.laps)])
+        latencies, errors, cpu, wall = run_once(script)
+        all_latencies += latencies
+        all_errors += errors
+        cpu_shares.append(cpu / wall)
+        print(f"run {run}: {len(latencies)} laps, latency p50 {percentile(latencies, 0.5):.0f} us, "
+              f"p95 {percentile(latencies, 0.95):.0f} us, max error {max(errors):.0f} us, CPU {cpu / wall:.1%}")
+
+    p95_latency = percentile(all_latencies, 0.95)
+    max_error = max(all_errors)
+    cpu_share = statistics.mean(cpu_shares)
+    print(f"overall: latency p50 {percentile(all_latencies, 0.5):.0f} us, p95 {p95_latency:.0f} us, "
+          f"p99 {percentile(all_latencies, 0.99):.0f} us")
+    print(f"overall: lap error mean {statistics.mean(all_errors):.0f} us, max {max_error:.0f} us")
+    print(f"overall: CPU {cpu_share:.1%} of one core per race")
+
+    failed = []
+    if args.max_latency_ms is not None and p95_latency > args.max_latency_ms * 1e3:
+        failed.append("latency")
+    if args.max_error_ms is not None and max_error > args.max_error_ms * 1e3:
+        failed.append("lap error")
+    if args.max_cpu is not None and cpu_share > args.max_cpu:
+        failed.append("CPU")
+    if failed:
+        print(f"FAILED: {', '.join(failed)} above threshold")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,184 @@
 import tkinter as tk
-from tkinter import PhotoImage, NW
+from tkinter import PhotoImage, NW, messagebox
 import customtkinter as ctk
+import threading
+import time
+import logging
 import cv2
+import numpy as np
+
+from vision_trigger import FinishLineTrigger
+from photo_finish import FrameHistory, PhotoFinish
+from video_recorder import VideoRecorder, recording_filename
+from camera_discovery import discover_cameras, load_cached_cameras, save_cached_cameras, capture_backend
+import instrumentation
+
+# Pause after a failed read, doubled while reads keep failing, in seconds
+CAPTURE_RETRY_DELAY = 0.01
+CAPTURE_RETRY_MAX_DELAY = 1.0
+
+class FrameRing:
+    # Fixed set of preallocated frames. The capture thread fills them in turn and
+    # the Tk thread borrows the newest one, which the writer then skips over.
+    def __init__(self, shape, slots=4):
+        self.frames = [np.empty(shape, dtype=np.uint8) for _ in range(slots)]
+        self.timestamps = [0] * slots
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.newest = None
+        self.borrowed = None
+
+    def next_slot(self):
+        with self.lock:
+            slot = (self.newest + 1) % len(self.frames) if self.newest is not None else 0
+            if slot == self.borrowed:
+                slot = (slot + 1) % len(self.frames)
+            return slot
+
+    def publish(self, slot, timestamp):
+        with self.lock:
+            self.timestamps[slot] = timestamp
+            self.newest = slot
+            self.sequence += 1
+
+    def borrow_newest(self, seen_sequence):
+        # Returns (sequence, frame, timestamp), or None if nothing newer than seen_sequence
+        with self.lock:
+            if self.newest is None or self.sequence == seen_sequence:
+                return None
+            self.borrowed = self.newest
+            return self.sequence, self.frames[self.newest], self.timestamps[self.newest]
+
+    def release(self):
+        with self.lock:
+            self.borrowed = None
+
+class CaptureThread(threading.Thread):
+    def __init__(self, cap, ring):
+        super().__init__(name="CameraCapture", daemon=True)
+        self.cap = cap
+        self.ring = ring
+        self.running = True
+        self.frames_captured = 0
+        # Set while reads keep failing, with how many have failed in a row, for the UI
+        self.failed = False
+        self.failed_reads = 0
+        # Called as listener(frame, timestamp) on this thread; the frame is only valid during the call
+        self.listeners = []
+
+    def run(self):
+        while self.running:
+            slot = self.ring.next_slot()
+            buffer = self.ring.frames[slot]
+            ret, img = self.cap.read(buffer)
+            if not ret:
+                # Logged once per run of failures, backing off while the camera is gone
+                if not self.failed:
+                    logging.warning("Camera stopped delivering frames, retrying")
+                self.failed = True
+                self.failed_reads += 1
+                time.sleep(min(CAPTURE_RETRY_MAX_DELAY, CAPTURE_RETRY_DELAY * 2 ** min(self.failed_reads - 1, 10)))
+                continue
+            timestamp = time.perf_counter_ns()
+            if self.failed:
+                logging.warning(f"Camera recovered after {self.failed_reads} failed reads")
+                self.failed = False
+                self.failed_reads = 0
+            if img is not buffer:
+                # The camera changed format; keep the ring's preallocated layout
+                if img.shape != buffer.shape:
+                    img = cv2.resize(img, (buffer.shape[1], buffer.shape[0]))
+                np.copyto(buffer, img)
+            self.ring.publish(slot, timestamp)
+            self.frames_captured += 1
+            for listener in self.listeners:
+                try:
+                    listener(buffer, timestamp)
+                except Exception as e:
+                    logging.error(f"Frame listener failed: {str(e)}")
+
+    def stop(self):
+        self.running = False
+
+class RateMeter:
+    def __init__(self):
+        self.count = 0
+        self.started = time.perf_counter()
+        self.rate = 0.0
+
+    def update(self, count):
+        now = time.perf_counter()
+        elapsed = now - self.started
+        if elapsed >= 1.0:
+            self.rate = (count - self.count) / elapsed
+            self.count = count
+            self.started = now
+        return self.rate
+
+class FrameDisplay:
+    # Draws frames into one PhotoImage behind one canvas item. The PPM buffer, the
+    # RGB view into it and the resize target are only reallocated on a size change.
+    def __init__(self, canvas, frame_shape):
+        self.canvas = canvas
+        self.frame_height, self.frame_width = frame_shape[:2]
+        self.size = None
+        self.ppm = None
+        self.rgb = None
+        self.resized = None
+        self.photo = PhotoImage(width=self.frame_width, height=self.frame_height)
+        self.item = canvas.create_image(0, 0, image=self.photo, anchor=NW)
+
+    def fit(self, width, height):
+        scale = min(width / self.frame_width, height / self.frame_height)
+        size = (max(1, int(self.frame_width * scale)), max(1, int(self.frame_height * scale)))
+        if size == self.size:
+            return
+        self.size = size
+        new_w, new_h = size
+        header = f'P6 {new_w} {new_h} 255 '.encode()
+        self.ppm = bytearray(len(header) + new_w * new_h * 3)
+        self.ppm[:len(header)] = header
+        self.rgb = np.frombuffer(self.ppm, dtype=np.uint8, offset=len(header)).reshape(new_h, new_w, 3)
+        if size == (self.frame_width, self.frame_height):
+            self.resized = None
+        else:
+            self.resized = np.empty((new_h, new_w, 3), dtype=np.uint8)
+        self.photo.configure(width=new_w, height=new_h)
+
+    def show(self, img):
+        if self.size is None:
+            self.fit(self.frame_width, self.frame_height)
+        if self.resized is not None:
+            cv2.resize(img, self.size, dst=self.resized, interpolation=cv2.INTER_AREA)
+            img = self.resized
+        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=self.rgb)
+        # Tcl only takes bytes objects, so this is the one copy left per frame
+        self.photo.configure(data=bytes(self.ppm), format='PPM')
 
 class CameraApp:
-    def __init__(self, root):
+    def __init__(self, root, race_events=None, lane_count=1, lap_listeners=None):
         self.root = root
+        self.race_events = race_events
+        self.lane_count = lane_count
+        self.lap_listeners = lap_listeners
+        self.photo_finish = None
+        self.frame_history = None
+        self.recorder = None
+        self.triggers = {}
+        self.roi_start = None
         self.root.title("Camera Stream")
         self.camera_index = None
         self.cap = None
+        self.ring = None
+        self.capture_thread = None
+        self.display = None
+        self.shown_sequence = 0
+        self.frames_shown = 0
+        self.capture_rate = RateMeter()
+        self.display_rate = RateMeter()
+        self.closed = False
+        self.unavailable_logged = False
+        self.failure_shown = False
 
         self.create_widgets()
         self.list_cameras()
@@ -27,75 +197,233 @@ class CameraApp:
         self.select_button.pack(pady=10)
 
     def list_cameras(self):
-        self.cameras = self.get_available_cameras()
-        if not self.cameras:
-            ctk.CTkMessagebox.show_error("Error", "No cameras available.")
-            self.root.destroy()
+        # Show the cached list straight away and refresh it in the background
+        self.cameras, last_camera = load_cached_cameras()
+        if last_camera is not None:
+            self.radio_var.set(last_camera)
+        self.show_camera_list()
+        self.discovery_result = None
+        threading.Thread(target=self.discover_in_background, name="CameraDiscovery", daemon=True).start()
+        self.root.after(100, self.check_discovery)
+
+    def discover_in_background(self):
+        try:
+            self.discovery_result = discover_cameras()
+        except Exception as e:
+            logging.error(f"Camera discovery failed: {str(e)}")
+            self.discovery_result = []
+
+    def check_discovery(self):
+        if self.closed or self.cap is not None:
+            return
+        if self.discovery_result is None:
+            self.root.after(100, self.check_discovery)
+            return
+        if self.discovery_result:
+            self.cameras = self.discovery_result
+            save_cached_cameras(cameras=self.cameras)
         else:
-            for i, cam in enumerate(self.cameras):
-                radio_button = ctk.CTkRadioButton(self.radio_frame, text=cam, variable=self.radio_var, value=i)
-                radio_button.pack(anchor='w')
-
-    def get_available_cameras(self):
-        available_cameras = []
-        for i in range(10):
-            cap = cv2.VideoCapture(i)
-            if cap.isOpened():
-                available_cameras.append(f"Camera {i}")
-                cap.release()
-        return available_cameras
+            # A busy or timed out probe finds nothing; keep the last good list
+            logging.warning("Camera discovery found no cameras, keeping the cached list")
+        self.show_camera_list()
+        if not self.cameras:
+            messagebox.showerror("Error", "No cameras available.", parent=self.root)
+            self.on_closing()
+
+    def show_camera_list(self):
+        for widget in self.radio_frame.winfo_children():
+            widget.destroy()
+        if not self.cameras:
+            ctk.CTkLabel(self.radio_frame, text="Searching for cameras...").pack(anchor='w')
+            return
+        for camera in self.cameras:
+            text = f"{camera['name']} ({camera['width']}x{camera['height']})"
+            radio_button = ctk.CTkRadioButton(self.radio_frame, text=text, variable=self.radio_var, value=camera['index'])
+            radio_button.pack(anchor='w')
 
     def select_camera(self):
         selection = self.radio_var.get()
         if selection != -1:
             self.camera_index = selection
+            save_cached_cameras(last_camera=selection)
             self.show_camera_feed()
 
     def show_camera_feed(self):
         self.clear_window()
-        self.cap = cv2.VideoCapture(self.camera_index)
+        self.cap = cv2.VideoCapture(self.camera_index, capture_backend())
+        cached = next((camera for camera in self.cameras if camera['index'] == self.camera_index), None)
+        if cached and cached['width'] and cached['height']:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, cached['width'])
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, cached['height'])
         if not self.cap.isOpened():
-            ctk.CTkMessagebox.show_error("Error", f"Cannot open camera {self.camera_index}.")
+            messagebox.showerror("Error", f"Cannot open camera {self.camera_index}.", parent=self.root)
             self.root.destroy()
             return
 
         ret, img = self.cap.read()
-        if ret:
-            h, w = img.shape[:2]
-            self.root.geometry(f"{w}x{h}")
-            self.root.minsize(w, h)
+        if not ret:
+            messagebox.showerror("Error", f"Cannot read from camera {self.camera_index}.", parent=self.root)
+            self.on_closing()
+            return
+        h, w = img.shape[:2]
+        self.root.geometry(f"{w}x{h}")
+        self.root.minsize(w, h)
 
-        self.canvas = tk.Canvas(self.root)
+        if self.race_events is not None:
+            self.create_trigger_toolbar()
+
+        self.canvas = tk.Canvas(self.root, highlightthickness=0)
         self.canvas.pack(fill=tk.BOTH, expand=True)
+        self.display = FrameDisplay(self.canvas, img.shape)
+        self.canvas.bind("<Configure>", self.on_canvas_resize)
+        if self.race_events is not None:
+            self.canvas.bind("<ButtonPress-1>", self.on_roi_press)
+            self.canvas.bind("<B1-Motion>", self.on_roi_drag)
+            self.canvas.bind("<ButtonRelease-1>", self.on_roi_release)
+
+        self.ring = FrameRing(img.shape)
+        self.capture_thread = CaptureThread(self.cap, self.ring)
+        if self.lap_listeners is not None:
+            self.frame_history = FrameHistory(img.shape)
+            self.photo_finish = PhotoFinish(self.frame_history)
+            self.photo_finish.start()
+            self.lap_listeners.append(self.photo_finish.on_lap)
+        self.update_trigger_listeners()
+        self.capture_thread.start()
 
         self.update_frame()
 
-    def photo_image(self, img):
-        h, w = img.shape[:2]
-        data = f'P6 {w} {h} 255 '.encode() + img[..., ::-1].tobytes()
-        return PhotoImage(width=w, height=h, data=data, format='PPM')
+    def create_trigger_toolbar(self):
+        toolbar = ctk.CTkFrame(self.root)
+        toolbar.pack(fill=tk.X)
+        lanes = [str(lane) for lane in range(1, self.lane_count + 1)]
+        ctk.CTkLabel(toolbar, text="Finish line for lane:").pack(side=tk.LEFT, padx=5, pady=5)
+        self.trigger_lane_menu = ctk.CTkOptionMenu(toolbar, values=lanes, width=60)
+        self.trigger_lane_menu.set(lanes[0])
+        self.trigger_lane_menu.pack(side=tk.LEFT, padx=5, pady=5)
+        ctk.CTkButton(toolbar, text="Clear Line", width=90, command=self.clear_trigger).pack(side=tk.LEFT, padx=5, pady=5)
+        self.record_button = ctk.CTkButton(toolbar, text="Record", width=90, command=self.toggle_recording, fg_color='#dc3545', text_color='white')
+        self.record_button.pack(side=tk.RIGHT, padx=5, pady=5)
+        self.trigger_status = ctk.CTkLabel(toolbar, text="Drag over the finish line to add a camera trigger")
+        self.trigger_status.pack(side=tk.LEFT, padx=5, pady=5)
 
-    def resize_image(self, img, width, height):
-        h, w = img.shape[:2]
-        scale = min(width / w, height / h)
-        new_w = int(w * scale)
-        new_h = int(h * scale)
-        return cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    def toggle_recording(self):
+        if self.recorder:
+            self.stop_recording()
+            return
+        fps = self.cap.get(cv2.CAP_PROP_FPS) or self.capture_rate.rate or 30.0
+        self.recorder = VideoRecorder(recording_filename(), self.ring.frames[0].shape, fps)
+        self.recorder.start()
+        if self.lap_listeners is not None:
+            self.lap_listeners.append(self.recorder.on_lap)
+        self.update_trigger_listeners()
+        self.record_button.configure(text="Stop Recording")
+
+    def stop_recording(self):
+        recorder = self.recorder
+        self.recorder = None
+        if self.lap_listeners is not None and recorder.on_lap in self.lap_listeners:
+            self.lap_listeners.remove(recorder.on_lap)
+        self.update_trigger_listeners()
+        recorder.stop()
+        logging.info(f"Saved {recorder.filename} ({recorder.frames_written} frames, {recorder.frames_dropped} dropped, {recorder.laps_marked} laps marked)")
+        if hasattr(self, 'record_button'):
+            self.record_button.configure(text="Record")
 
+    def display_scale(self):
+        # Frame pixels per canvas pixel
+        return self.display.frame_width / self.display.size[0] if self.display.size else 1.0
+
+    def on_canvas_resize(self, event):
+        self.display.fit(event.width, event.height)
+        self.draw_triggers()
+
+    def on_roi_press(self, event):
+        self.roi_start = (event.x, event.y)
+        self.canvas.delete("roi_drag")
+
+    def on_roi_drag(self, event):
+        if self.roi_start:
+            self.canvas.delete("roi_drag")
+            self.canvas.create_rectangle(*self.roi_start, event.x, event.y, outline='#ffc107', width=2, tags="roi_drag")
+
+    def on_roi_release(self, event):
+        if not self.roi_start:
+            return
+        self.canvas.delete("roi_drag")
+        scale = self.display_scale()
+        x0, x1 = sorted((self.roi_start[0], event.x))
+        y0, y1 = sorted((self.roi_start[1], event.y))
+        self.roi_start = None
+        x0, y0 = max(0, int(x0 * scale)), max(0, int(y0 * scale))
+        x1 = min(self.display.frame_width, int(x1 * scale))
+        y1 = min(self.display.frame_height, int(y1 * scale))
+        if x1 - x0 < 4 or y1 - y0 < 4:
+            return
+        lane = int(self.trigger_lane_menu.get())
+        self.triggers[lane] = FinishLineTrigger((x0, y0, x1 - x0, y1 - y0), self.race_events, lane)
+        self.update_trigger_listeners()
+        logging.info(f"Camera finish line for lane {lane} set to {(x0, y0, x1 - x0, y1 - y0)}")
+
+    def clear_trigger(self):
+        lane = int(self.trigger_lane_menu.get())
+        if self.triggers.pop(lane, None):
+            self.update_trigger_listeners()
+            logging.info(f"Camera finish line for lane {lane} cleared")
+
+    def update_trigger_listeners(self):
+        # Swapped as a whole so the capture thread never sees a half updated list
+        listeners = list(self.triggers.values())
+        if self.frame_history is not None:
+            listeners.append(self.frame_history)
+        if self.recorder is not None:
+            listeners.append(self.recorder)
+        self.capture_thread.listeners = listeners
+        self.draw_triggers()
+
+    def draw_triggers(self):
+        self.canvas.delete("roi")
+        scale = self.display_scale()
+        for lane, trigger in self.triggers.items():
+            x0, y0 = trigger.x / scale, trigger.y / scale
+            x1, y1 = (trigger.x + trigger.width) / scale, (trigger.y + trigger.height) / scale
+            self.canvas.create_rectangle(x0, y0, x1, y1, outline='#28a745', width=2, tags="roi")
+            self.canvas.create_text(x0 + 4, y0 + 2, text=f"Lane {lane}", anchor=NW, fill='#28a745', tags="roi")
+
+    @instrumentation.timed('camera.update_frame')
     def update_frame(self):
-        if self.cap and self.cap.isOpened():
-            ret, img = self.cap.read()
-            if ret:
-                width = self.root.winfo_width()
-                height = self.root.winfo_height()
-                img = self.resize_image(img, width, height)
-                photo = self.photo_image(img)
-                self.canvas.create_image(0, 0, image=photo, anchor=NW)
-                self.canvas.image = photo
-            else:
-                print("Failed to capture frame")
-        else:
-            print("Camera is not opened or not available")
+        if self.closed:
+            return
+        if self.capture_thread and self.capture_thread.is_alive():
+            # Only the newest frame is shown; anything captured in between is dropped
+            newest = self.ring.borrow_newest(self.shown_sequence)
+            if newest:
+                self.shown_sequence, img, timestamp = newest
+                try:
+                    self.display.show(img)
+                finally:
+                    self.ring.release()
+                self.frames_shown += 1
+            camera_fps = self.capture_rate.update(self.capture_thread.frames_captured)
+            display_fps = self.display_rate.update(self.frames_shown)
+            self.root.title(f"Camera Stream - camera {camera_fps:.0f} fps, display {display_fps:.0f} fps")
+            status = []
+            if self.capture_thread.failed:
+                status.append(f"Camera not delivering frames - {self.capture_thread.failed_reads} failed reads")
+            if self.triggers:
+                counts = ", ".join(f"lane {lane}: {trigger.triggers}" for lane, trigger in sorted(self.triggers.items()))
+                status.append(f"Camera triggers - {counts}")
+            if self.recorder:
+                status.append(f"Recording - {self.recorder.frames_written} frames, {self.recorder.frames_dropped} dropped")
+            if status:
+                self.trigger_status.configure(text="; ".join(status))
+            elif self.failure_shown:
+                self.trigger_status.configure(text="Drag over the finish line to add a camera trigger")
+            self.failure_shown = self.capture_thread.failed
+            self.unavailable_logged = False
+        elif not self.unavailable_logged:
+            logging.warning("Camera is not opened or not available")
+            self.unavailable_logged = True
 
         self.root.after(30, self.update_frame)
 
@@ -104,15 +432,25 @@ class CameraApp:
             widget.destroy()
 
     def on_closing(self):
+        self.closed = True
+        if self.recorder:
+            self.stop_recording()
+        if self.photo_finish:
+            if self.photo_finish.on_lap in self.lap_listeners:
+                self.lap_listeners.remove(self.photo_finish.on_lap)
+            self.photo_finish.stop()
+        if self.capture_thread:
+            self.capture_thread.stop()
+            self.capture_thread.join(1)
         if self.cap:
             self.cap.release()
         self.root.destroy()
 
-def open_camera_window():
+def open_camera_window(race_events=None, lane_count=1, lap_listeners=None):
     ctk.set_appearance_mode("System")  # Modes: "System" (default), "Dark", "Light"
     ctk.set_default_color_theme("blue")  # Themes: "blue" (default), "green", "dark-blue"
     new_window = ctk.CTkToplevel()
     new_window.title("Camera Stream")
-    CameraApp(new_window)
-    new_window.protocol("WM_DELETE_WINDOW", lambda: new_window.destroy())
+    app = CameraApp(new_window, race_events, lane_count, lap_listeners)
+    new_window.protocol("WM_DELETE_WINDOW", app.on_closing)
     new_window.lift()
\ No newline at end of file
@@ -0,0 +1,80 @@
+import glob
+import re
+import sys
+import time
+import threading
+import logging
+
+import cv2
+
+from data_manager import load_data, save_data_atomic
+
+SETTINGS_FILE = 'settings.json'
+
+
+def capture_backend():
+    # V4L2 directly avoids the slow GStreamer probing OpenCV may otherwise try first
+    return cv2.CAP_V4L2 if sys.platform.startswith('linux') else cv2.CAP_ANY
+
+
+def candidate_indices(max_index=10):
+    if sys.platform.startswith('linux'):
+        indices = []
+        for path in glob.glob('/dev/video*'):
+            match = re.fullmatch(r'/dev/video(\d+)', path)
+            if match:
+                indices.append(int(match.group(1)))
+        return sorted(indices)
+    return list(range(max_index))
+
+
+def probe_camera(index):
+    cap = cv2.VideoCapture(index, capture_backend())
+    try:
+        if not cap.isOpened():
+            return None
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        return {'index': index, 'name': f"Camera {index}", 'width': width, 'height': height}
+    finally:
+        cap.release()
+
+
+def discover_cameras(timeout=2.0):
+    # Every candidate is probed at once on its own daemon thread. A probe that
+    # has not answered by the timeout is left behind and its camera skipped;
+    # being a daemon it cannot hold up the application exiting, as a hung
+    # VideoCapture in a ThreadPoolExecutor worker would.
+    indices = candidate_indices()
+    results = {}
+
+    def probe(index):
+        try:
+            results[index] = probe_camera(index)
+        except Exception as e:
+            logging.error(f"Failed to probe camera {index}: {str(e)}")
+
+    threads = [threading.Thread(target=probe, args=(index,), name=f"CameraProbe-{index}", daemon=True) for index in indices]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + timeout
+    for index, thread in zip(indices, threads):
+        thread.join(max(0.0, deadline - time.monotonic()))
+        if thread.is_alive():
+            logging.warning(f"Camera {index} did not answer within {timeout} s")
+    cameras = [camera for camera in (results.get(index) for index in indices) if camera is not None]
+    return sorted(cameras, key=lambda camera: camera['index'])
+
+
+def load_cached_cameras():
+    settings = load_data(SETTINGS_FILE, 0)
+    return settings.get('cameras', []), settings.get('last_camera')
+
+
+def save_cached_cameras(cameras=None, last_camera=None):
+    settings = load_data(SETTINGS_FILE, 0)
+    if cameras is not None:
+        settings['cameras'] = cameras
+    if last_camera is not None:
+        settings['last_camera'] = last_camera
+    save_data_atomic(SETTINGS_FILE, settings)
@@ -0,0 +1,44 @@
+import sys
+import queue
+import time
+from collections import namedtuple
+
+# One countdown step that came due. number counts down to 0, which is GO;
+# fired is the perf_counter_ns stamp taken the moment the step was released.
+CountdownStep = namedtuple('CountdownStep', ['number', 'deadline', 'fired'])
+
+# Queue waits can wake a whole timer tick late on Windows (about 15 ms), so the
+# last stretch before each deadline is spent yielding the CPU instead
+SPIN_MARGIN_NS = 20_000_000 if sys.platform == 'win32' else 2_000_000
+
+
+class CountdownSchedule:
+    # Every step has a fixed deadline worked out from one start time, so a late
+    # wake-up or a slow sound never pushes the following steps back. The first
+    # number is shown one interval after the start and GO one interval after
+    # the last number, as the original countdown did.
+    def __init__(self, seconds, interval=1.0, start_ns=None):
+        start_ns = time.perf_counter_ns() if start_ns is None else start_ns
+        interval_ns = int(interval * 1e9)
+        self.steps = [(start_ns + (index + 1) * interval_ns, seconds - index) for index in range(seconds + 1)]
+
+    @property
+    def go_deadline(self):
+        return self.steps[-1][0]
+
+    def run(self, events):
+        # Yields every event received while waiting and a CountdownStep as each
+        # step comes due, ending with GO
+        for deadline, number in self.steps:
+            while True:
+                remaining = deadline - time.perf_counter_ns()
+                if remaining <= SPIN_MARGIN_NS:
+                    break
+                try:
+                    event = events.get(timeout=(remaining - SPIN_MARGIN_NS) / 1e9)
+                except queue.Empty:
+                    continue
+                yield event
+            while time.perf_counter_ns() < deadline:
+                time.sleep(0)
+            yield CountdownStep(number, deadline, time.perf_counter_ns())
@@ -1,4 +1,7 @@
 import json
+import os
+
+from instrumentation import timed
 
 def load_data(filename, type):
     try:
@@ -16,6 +19,17 @@ def load_data(filename, type):
             data = {}
     return data
 
+@timed('save_data')
 def save_data(filename, data):
     with open(filename, 'w') as file:
-        json.dump(data, file)
\ No newline at end of file
+        json.dump(data, file)
+
+@timed('save_data')
+def save_data_atomic(filename, data):
+    # Write next to the target and swap it in, so a crash never leaves a half written file
+    temp_filename = f"{filename}.tmp"
+    with open(temp_filename, 'w') as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_filename, filename)
@@ -0,0 +1,100 @@
+import tkinter as tk
+import customtkinter as ctk
+
+
+class DriverList(ctk.CTkFrame):
+    # A search box over a fixed set of radio buttons. Only `rows` buttons ever
+    # exist: they show a window onto the roster's search result, and scrolling
+    # or typing relabels them, so a roster of thousands opens as fast as one
+    # of ten. The selection is kept by name and survives scrolling and
+    # filtering.
+    def __init__(self, master, roster, rows=8, command=None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.roster = roster
+        self.command = command
+        self.rows = rows
+        self.top = 0
+        self.matches = []
+        self.radiobutton_variable = ctk.StringVar()
+
+        self.search_entry = ctk.CTkEntry(self, placeholder_text="Search drivers")
+        self.search_entry.grid(row=0, column=0, columnspan=2, pady=(5, 10), padx=5, sticky="ew")
+        self.search_entry.bind("<KeyRelease>", lambda event: self.search())
+
+        self.radiobutton_list = []
+        for row in range(rows):
+            radiobutton = ctk.CTkRadioButton(self, text="", value="", variable=self.radiobutton_variable, command=self.on_select)
+            radiobutton.grid(row=row + 1, column=0, pady=(0, 10), padx=5, sticky="w")
+            self.bind_wheel(radiobutton)
+            self.radiobutton_list.append(radiobutton)
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.on_scrollbar)
+        self.scrollbar.grid(row=1, column=1, rowspan=rows, sticky="ns")
+        self.bind_wheel(self)
+        self.grid_columnconfigure(0, weight=1)
+        self.refresh()
+
+    def bind_wheel(self, widget):
+        widget.bind("<MouseWheel>", lambda event: self.scroll(-1 if event.delta > 0 else 1))
+        widget.bind("<Button-4>", lambda event: self.scroll(-1))
+        widget.bind("<Button-5>", lambda event: self.scroll(1))
+
+    def on_select(self):
+        if self.command is not None:
+            self.command()
+
+    def scroll(self, rows):
+        self.top = max(0, min(self.top + rows, len(self.matches) - self.rows))
+        self.redraw()
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.top = int(float(amount) * len(self.matches))
+            self.scroll(0)
+        elif action == 'scroll':
+            self.scroll(int(amount) * (self.rows if unit == 'pages' else 1))
+
+    def search(self):
+        # A new filter starts from its first match
+        self.top = 0
+        self.refresh()
+
+    def refresh(self):
+        # Re-run the search after a change to the roster, keeping the scroll position
+        self.matches = self.roster.search(self.search_entry.get())
+        self.scroll(0)
+
+    def redraw(self):
+        total = len(self.matches)
+        self.scrollbar.set(self.top / total if total else 0.0, min(1.0, (self.top + self.rows) / total) if total else 1.0)
+        for slot, radiobutton in enumerate(self.radiobutton_list):
+            index = self.top + slot
+            name = self.matches[index] if index < total else None
+            if name is None:
+                radiobutton.grid_remove()
+                continue
+            if radiobutton.cget("text") != name:
+                radiobutton.configure(text=name, value=name)
+                # The value changed under the variable, so redraw the checked state
+                if name == self.radiobutton_variable.get():
+                    radiobutton.select(from_variable_callback=True)
+                else:
+                    radiobutton.deselect(from_variable_callback=True)
+            radiobutton.grid()
+
+    def show(self, name):
+        # Scroll so that name is on screen, clearing the search if it hides it
+        if name not in self.matches:
+            self.search_entry.delete(0, tk.END)
+            self.matches = self.roster.search()
+        if name in self.roster:
+            self.top = self.matches.index(name)
+            self.scroll(0)
+
+    def select(self, name):
+        self.radiobutton_variable.set(name)
+        self.show(name)
+
+    def get_checked_item(self):
+        # A driver removed from the roster is no longer a selection
+        name = self.radiobutton_variable.get()
+        return name if name in self.roster else ""
@@ -0,0 +1,93 @@
+import os
+import threading
+import logging
+
+from instrumentation import timed
+
+# openpyxl is imported where it is used, so loading it happens on the
+# exporter thread instead of delaying application startup
+
+LEADERBOARD_HEADERS = ["Rank", "Driver", "Last Lap (s)", "Best Lap (s)"]
+LEADERBOARD_WIDTHS = {"A": 10, "B": 40, "C": 20, "D": 20}
+
+
+def add_leaderboard_styles(workbook):
+    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill, NamedStyle
+
+    thin_side = Side(border_style="thin")
+    thin_border = Border(left=thin_side, right=thin_side, top=thin_side, bottom=thin_side)
+    centered = Alignment(horizontal="center")
+    shaded = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
+    # One named style per look, shared by every cell instead of per-cell style objects
+    workbook.add_named_style(NamedStyle(name="leaderboard_header", font=Font(bold=True), alignment=centered, border=thin_border))
+    workbook.add_named_style(NamedStyle(name="leaderboard_row", alignment=centered, border=thin_border))
+    workbook.add_named_style(NamedStyle(name="leaderboard_row_shaded", alignment=centered, border=thin_border, fill=shaded))
+
+
+def styled_row(worksheet, values, style):
+    from openpyxl.cell import WriteOnlyCell
+
+    row = []
+    for value in values:
+        cell = WriteOnlyCell(worksheet, value=value)
+        cell.style = style
+        row.append(cell)
+    return row
+
+
+@timed('excel.write_leaderboard')
+def write_leaderboard(filename, results):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    add_leaderboard_styles(workbook)
+    worksheet = workbook.create_sheet("Leaderboard")
+    for column, width in LEADERBOARD_WIDTHS.items():
+        worksheet.column_dimensions[column].width = width
+
+    worksheet.append(styled_row(worksheet, LEADERBOARD_HEADERS, "leaderboard_header"))
+    for index, result in enumerate(results, start=1):
+        values = [index, result['driver'], f"{result['last_time']:.3f}", f"{result['best_time']:.3f}"]
+        worksheet.append(styled_row(worksheet, values, "leaderboard_row_shaded" if index % 2 == 0 else "leaderboard_row"))
+
+    # Save beside the target and swap it in, so readers never see a half written file
+    temp_filename = f"{filename}.tmp"
+    workbook.save(temp_filename)
+    os.replace(temp_filename, filename)
+
+
+class LeaderboardExporter(threading.Thread):
+    # Writes leaderboard.xlsx off the timing path. Requests only mark the
+    # leaderboard dirty, so a burst of refreshes produces a single write.
+    def __init__(self, leaderboard, filename='leaderboard.xlsx'):
+        super().__init__(name="LeaderboardExporter", daemon=True)
+        self.leaderboard = leaderboard
+        self.filename = filename
+        self.condition = threading.Condition()
+        self.pending = False
+        self.running = True
+
+    def request(self):
+        with self.condition:
+            self.pending = True
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                self.pending = False
+            try:
+                write_leaderboard(self.filename, self.leaderboard.ranked())
+            except Exception as e:
+                logging.error(f"Failed to dump leaderboard to Excel: {str(e)}")
+
+    def stop(self, timeout=5):
+        # Any pending request is still written before the thread exits
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.join(timeout)
@@ -0,0 +1,168 @@
+import json
+import time
+import threading
+import functools
+
+# Off by default. While off, span() hands back a shared do-nothing context
+# manager and timed functions call straight through, so the cost of leaving
+# the spans in place is one global lookup per call.
+enabled = False
+
+# Log-linear buckets: values below 2 * SUB_BUCKETS ns are exact, above that each
+# power of two is split into SUB_BUCKETS buckets, so any percentile is within
+# about 6 % of the true value while a histogram stays a fixed size list.
+SUB_BITS = 4
+SUB_BUCKETS = 1 << SUB_BITS
+BUCKETS = 64 * SUB_BUCKETS
+
+lock = threading.Lock()
+histograms = {}
+counters = {}
+started = time.time()
+
+
+def bucket_index(ns):
+    if ns < 2 * SUB_BUCKETS:
+        return max(0, ns)
+    shift = ns.bit_length() - SUB_BITS - 1
+    return (shift + 1) * SUB_BUCKETS + (ns >> shift) - SUB_BUCKETS
+
+
+def bucket_value(index):
+    # Middle of the bucket in nanoseconds
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    low = (index - shift * SUB_BUCKETS) << shift
+    return low + (1 << shift) // 2
+
+
+class Histogram:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns):
+        index = min(bucket_index(ns), BUCKETS - 1)
+        with self.lock:
+            self.buckets[index] += 1
+            self.count += 1
+            self.total += ns
+            if ns > self.max:
+                self.max = ns
+
+    def percentiles(self, fractions):
+        with self.lock:
+            buckets = list(self.buckets)
+            count = self.count
+            largest = self.max
+        results = []
+        targets = iter(sorted(fractions))
+        target = next(targets, None)
+        seen = 0
+        for index, bucket in enumerate(buckets):
+            seen += bucket
+            while target is not None and count and seen >= target * count:
+                results.append(min(bucket_value(index), largest))
+                target = next(targets, None)
+        results += [0] * (len(fractions) - len(results))
+        return results
+
+
+class Span:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.record(time.perf_counter_ns() - self.start)
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def enable(on=True):
+    global enabled
+    enabled = bool(on)
+
+
+def histogram(name):
+    found = histograms.get(name)
+    if found is None:
+        with lock:
+            found = histograms.setdefault(name, Histogram())
+    return found
+
+
+def span(name):
+    if not enabled:
+        return NULL_SPAN
+    return Span(histogram(name))
+
+
+def timed(name):
+    # Decorator form of span for whole functions and methods
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with Span(histogram(name)):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record(name, ns):
+    # For latencies measured between two points rather than around a block
+    if enabled:
+        histogram(name).record(ns)
+
+
+def count(name, amount=1):
+    if enabled:
+        with lock:
+            counters[name] = counters.get(name, 0) + amount
+
+
+def reset():
+    global started
+    with lock:
+        histograms.clear()
+        counters.clear()
+        started = time.time()
+
+
+def snapshot():
+    # Milliseconds throughout, ready for json.dumps
+    spans = {}
+    for name, found in sorted(list(histograms.items())):
+        p50, p95, p99 = found.percentiles([0.5, 0.95, 0.99])
+        spans[name] = {'count': found.count, 'mean_ms': found.total / found.count / 1e6 if found.count else 0,
+                       'p50_ms': p50 / 1e6, 'p95_ms': p95 / 1e6, 'p99_ms': p99 / 1e6, 'max_ms': found.max / 1e6}
+    with lock:
+        counts = dict(sorted(counters.items()))
+    return {'enabled': enabled, 'since': started, 'time': time.time(), 'spans': spans, 'counters': counts}
+
+
+def dump(filename):
+    with open(filename, 'w') as file:
+        json.dump(snapshot(), file, indent=2)
@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+import time
+import logging
+
+from data_manager import load_data, save_data_atomic
+
+
+class LapJournal:
+    # Append-only record of every lap and driver removal. The leaderboard snapshot
+    # remembers how far into the journal it is, so startup only replays the tail.
+    def __init__(self, filename='laps.jsonl', snapshot_filename='results.json', fsync_interval=0.2, compact_every=200):
+        self.filename = filename
+        self.snapshot_filename = snapshot_filename
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.records_since_snapshot = 0
+        self.lock = threading.Lock()
+        self.sync_needed = threading.Condition(self.lock)
+        self.dirty = False
+        self.running = True
+        self.file = None
+        self.sync_thread = None
+        # (journal offset, results callable) for sync_loop to write as the next snapshot
+        self.compaction = None
+
+    def load(self):
+        snapshot = load_data(self.snapshot_filename, 0)
+        if isinstance(snapshot, list):
+            # results.json from before the journal existed
+            results, offset = snapshot, 0
+        else:
+            results, offset = snapshot.get('results', []), snapshot.get('journal_offset', 0)
+        by_driver = {result['driver']: result for result in results}
+
+        replayed = 0
+        if os.path.exists(self.filename):
+            with open(self.filename, 'rb') as file:
+                file.seek(offset)
+                for raw in file:
+                    try:
+                        record = json.loads(raw)
+                    except ValueError:
+                        # Only the last line can be torn by a crash mid-write
+                        logging.warning(f"Skipping unreadable journal record in {self.filename}")
+                        continue
+                    apply_record(by_driver, record)
+                    replayed += 1
+        self.records_since_snapshot = replayed
+        logging.info(f"Loaded {len(by_driver)} results, replayed {replayed} journal records")
+        self.open()
+        return list(by_driver.values())
+
+    def open(self):
+        self.file = open(self.filename, 'ab')
+        if self.file.tell() > 0:
+            with open(self.filename, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b'\n':
+                    # Terminate a torn record so the next one starts on a fresh line
+                    self.file.write(b'\n')
+        self.sync_thread = threading.Thread(target=self.sync_loop, name="LapJournalSync", daemon=True)
+        self.sync_thread.start()
+
+    def append(self, record):
+        line = json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self.lock:
+            self.file.write(line)
+            # Flushed to the OS straight away; fsync is batched by sync_loop
+            self.file.flush()
+            self.records_since_snapshot += 1
+            if not self.dirty:
+                self.dirty = True
+                self.sync_needed.notify()
+
+    def append_lap(self, race_id, lane, driver, lap, lap_time, penalty, reaction=None):
+        record = {'type': 'lap', 'race': race_id, 'lane': lane, 'driver': driver, 'lap': lap,
+                  'time': lap_time, 'penalty': penalty, 'timestamp': time.time()}
+        if reaction is not None:
+            # Seconds from GO to the first crossing, negative for a jump start; first laps only
+            record['reaction'] = reaction
+        self.append(record)
+
+    def append_removal(self, driver):
+        self.append({'type': 'remove', 'driver': driver, 'timestamp': time.time()})
+
+    def sync_loop(self):
+        # Every write reaches the disk within fsync_interval, with one fsync per
+        # batch, and compactions are written here too. The lock is released for
+        # the disk work itself so append never waits on it; close joins this
+        # thread before closing the file.
+        while True:
+            with self.lock:
+                while self.running and not self.dirty and self.compaction is None:
+                    self.sync_needed.wait()
+                if self.compaction is None:
+                    self.sync_needed.wait(self.fsync_interval)
+                if not self.running:
+                    # close writes its own snapshot
+                    return
+                compaction, self.compaction = self.compaction, None
+                fileno = self.file.fileno()
+                self.dirty = False
+            os.fsync(fileno)
+            if compaction is not None:
+                self.write_snapshot(*compaction)
+
+    def maybe_compact(self, results):
+        # Only marks where the snapshot is taken; sync_loop fsyncs the journal
+        # and calls results to write it, so the timing thread does no disk work.
+        # results may run ahead of the offset, which replay tolerates since a
+        # lap or removal applied twice leaves the same result. True if one is due.
+        with self.lock:
+            if self.records_since_snapshot < self.compact_every or self.file is None:
+                return False
+            self.file.flush()
+            self.compaction = (self.file.tell(), results)
+            self.records_since_snapshot = 0
+            self.sync_needed.notify()
+        return True
+
+    def write_snapshot(self, offset, results):
+        try:
+            save_data_atomic(self.snapshot_filename, {'journal_offset': offset, 'results': results()})
+        except Exception as e:
+            logging.error(f"Failed to compact lap journal: {str(e)}")
+            return
+        logging.info(f"Compacted lap journal at offset {offset}")
+
+    def offset(self):
+        # Byte offset just past the last record written
+        with self.lock:
+            if self.file is None:
+                return os.path.getsize(self.filename) if os.path.exists(self.filename) else 0
+            self.file.flush()
+            return self.file.tell()
+
+    def compact(self, results):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.dirty = False
+            offset = self.file.tell()
+            save_data_atomic(self.snapshot_filename, {'journal_offset': offset, 'results': results})
+            self.records_since_snapshot = 0
+        logging.info(f"Compacted lap journal at offset {offset}")
+
+    def close(self, results):
+        if self.file is None:
+            return
+        # The sync thread is stopped first, so its snapshot cannot land after this one
+        with self.lock:
+            self.running = False
+            self.sync_needed.notify()
+        if self.sync_thread is not None:
+            self.sync_thread.join()
+        self.compact(results)
+        with self.lock:
+            self.file.close()
+            self.file = None
+
+def apply_record(by_driver, record):
+    if record.get('type') == 'remove':
+        by_driver.pop(record['driver'], None)
+    elif record.get('type') == 'lap':
+        driver, lap_time = record['driver'], record['time']
+        result = by_driver.get(driver)
+        if result is None:
+            by_driver[driver] = {'driver': driver, 'last_time': lap_time, 'best_time': lap_time}
+        else:
+            result['last_time'] = lap_time
+            result['best_time'] = min(result['best_time'], lap_time)
@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+import logging
+
+import numpy as np
+
+# One row per lap. Drivers and races are stored as indexes into the names and
+# races lists; reaction is NaN for laps after the first.
+COLUMNS = {
+    'driver': np.int32,
+    'race': np.int32,
+    'lap': np.int32,
+    'time': np.float64,
+    'penalty': np.float64,
+    'reaction': np.float64,
+    'timestamp': np.float64,
+}
+
+
+class LapHistory:
+    # Every lap of the season in column arrays that double in size when full,
+    # so appending a lap is amortised constant time and the stats engine works
+    # on whole columns. A removed driver keeps their rows but their id is
+    # retired: alive[id] goes False and a later driver of the same name gets
+    # a new id.
+    def __init__(self, capacity=1024):
+        self.lock = threading.Lock()
+        self.columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.count = 0
+        self.names = []
+        self.driver_ids = {}
+        self.alive = []
+        self.races = []
+        self.race_ids = {}
+        # Driver ids with laps or removals since the stats engine last looked
+        self.changed = set()
+        # How far into the lap journal the history has read
+        self.journal_offset = 0
+
+    def __len__(self):
+        return self.count
+
+    def driver_id(self, driver):
+        found = self.driver_ids.get(driver)
+        if found is None:
+            found = self.driver_ids[driver] = len(self.names)
+            self.names.append(driver)
+            self.alive.append(True)
+        return found
+
+    def race_index(self, race_id):
+        found = self.race_ids.get(race_id)
+        if found is None:
+            found = self.race_ids[race_id] = len(self.races)
+            self.races.append(race_id)
+        return found
+
+    def append(self, race_id, driver, lap, lap_time, penalty=0, reaction=None, timestamp=0.0):
+        with self.lock:
+            if self.count == len(self.columns['time']):
+                for name, column in self.columns.items():
+                    grown = np.empty(len(column) * 2, dtype=column.dtype)
+                    grown[:self.count] = column[:self.count]
+                    self.columns[name] = grown
+            index = self.count
+            driver_id = self.driver_id(driver)
+            self.columns['driver'][index] = driver_id
+            self.columns['race'][index] = self.race_index(race_id)
+            self.columns['lap'][index] = lap
+            self.columns['time'][index] = lap_time
+            self.columns['penalty'][index] = penalty
+            self.columns['reaction'][index] = np.nan if reaction is None else reaction
+            self.columns['timestamp'][index] = timestamp
+            self.count += 1
+            self.changed.add(driver_id)
+
+    def remove_driver(self, driver):
+        with self.lock:
+            driver_id = self.driver_ids.pop(driver, None)
+            if driver_id is not None:
+                self.alive[driver_id] = False
+                self.changed.add(driver_id)
+
+    def apply_record(self, record):
+        # Same journal records as journal.apply_record
+        if record.get('type') == 'remove':
+            self.remove_driver(record['driver'])
+        elif record.get('type') == 'lap':
+            self.append(record.get('race', ''), record['driver'], record.get('lap', 0), record['time'],
+                        record.get('penalty', 0), record.get('reaction'), record.get('timestamp', 0.0))
+
+    def take_changed(self):
+        with self.lock:
+            changed, self.changed = self.changed, set()
+        return changed
+
+    def view(self):
+        # Consistent read-only views for another thread: rows below count are
+        # never written again, and a grow copies rather than moves them
+        with self.lock:
+            columns = {name: column[:self.count] for name, column in self.columns.items()}
+            return columns, np.array(self.alive, dtype=bool), list(self.names)
+
+    def laps(self, driver):
+        # Lap times of one driver in the order they were run
+        with self.lock:
+            driver_id = self.driver_ids.get(driver)
+            if driver_id is None:
+                return np.empty(0)
+            times = self.columns['time'][:self.count]
+            return times[self.columns['driver'][:self.count] == driver_id]
+
+    def state(self):
+        # Everything save needs, taken at one instant so it can be written on
+        # another thread while laps keep arriving
+        with self.lock:
+            arrays = {name: column[:self.count] for name, column in self.columns.items()}
+            arrays['names'] = np.array(self.names, dtype=str)
+            arrays['alive'] = np.array(self.alive, dtype=bool)
+            arrays['races'] = np.array(self.races, dtype=str)
+        return arrays
+
+    @staticmethod
+    def write(filename, state, journal_offset):
+        # Column snapshot that lets load skip the journal up to journal_offset
+        temp_filename = f"{filename}.tmp.npz"
+        np.savez(temp_filename, journal_offset=np.array(journal_offset), **state)
+        os.replace(temp_filename, filename)
+
+    def save(self, filename, journal_offset):
+        self.write(filename, self.state(), journal_offset)
+
+    def restore(self, filename):
+        # Returns the journal offset the snapshot was taken at, or 0 without one
+        try:
+            with np.load(filename, allow_pickle=False) as snapshot:
+                count = len(snapshot['time'])
+                columns = {name: np.empty(max(1024, count * 2), dtype=dtype) for name, dtype in COLUMNS.items()}
+                for name in COLUMNS:
+                    columns[name][:count] = snapshot[name]
+                names = [str(name) for name in snapshot['names']]
+                alive = snapshot['alive'].tolist()
+                races = [str(race) for race in snapshot['races']]
+                offset = int(snapshot['journal_offset'])
+        except FileNotFoundError:
+            return 0
+        except (OSError, KeyError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable lap history {filename}: {str(e)}")
+            return 0
+        with self.lock:
+            self.columns = columns
+            self.count = count
+            self.names = names
+            self.alive = alive
+            self.driver_ids = {name: index for index, name in enumerate(names) if alive[index]}
+            self.races = races
+            self.race_ids = {race: index for index, race in enumerate(races)}
+            self.changed = set(range(len(names)))
+        return offset
+
+    def replay(self, journal_filename):
+        # Applies the journal from journal_offset on and moves it past the last
+        # complete line; a line still being written is left for the next replay
+        if not os.path.exists(journal_filename):
+            return 0
+        replayed = 0
+        with open(journal_filename, 'rb') as file:
+            file.seek(self.journal_offset)
+            for raw in file:
+                if not raw.endswith(b'\n'):
+                    break
+                self.journal_offset += len(raw)
+                try:
+                    record = json.loads(raw)
+                except ValueError:
+                    continue
+                self.apply_record(record)
+                replayed += 1
+        return replayed
+
+    @classmethod
+    def load(cls, journal_filename='laps.jsonl', snapshot_filename='lap_history.npz'):
+        history = cls()
+        history.journal_offset = history.restore(snapshot_filename)
+        if os.path.exists(journal_filename) and history.journal_offset > os.path.getsize(journal_filename):
+            # The journal was replaced since the snapshot, so it is the only truth
+            logging.warning(f"Lap history snapshot is ahead of {journal_filename}, rebuilding it")
+            history = cls()
+        replayed = history.replay(journal_filename)
+        logging.info(f"Loaded lap history of {len(history)} laps, replayed {replayed} journal records")
+        return history
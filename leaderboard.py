@@ -0,0 +1,78 @@
+import bisect
+import threading
+from collections import namedtuple
+
+# Ranks are 1-based; old_rank is None for a driver's first lap and new_rank is
+# None once the driver is removed. Every rank between the two has changed.
+LeaderboardChange = namedtuple('LeaderboardChange', ['driver', 'old_rank', 'new_rank'])
+
+
+class Leaderboard:
+    # Results keyed by driver and kept ordered by best lap, so a new lap only
+    # touches the one entry it belongs to instead of re-sorting everything.
+    def __init__(self, results=()):
+        # Laps are recorded on the race thread while the Tk thread reads ranks
+        self.lock = threading.RLock()
+        self.entries = {}
+        self.order = []
+        for result in results:
+            if 'best_time' in result:
+                self.entries[result['driver']] = dict(result)
+                self.order.append((result['best_time'], result['driver']))
+        self.order.sort()
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, driver):
+        return driver in self.entries
+
+    def get(self, driver):
+        return self.entries.get(driver)
+
+    def rank(self, driver):
+        with self.lock:
+            entry = self.entries.get(driver)
+            if entry is None:
+                return None
+            return bisect.bisect_left(self.order, (entry['best_time'], driver)) + 1
+
+    def record_lap(self, driver, lap_time):
+        with self.lock:
+            entry = self.entries.get(driver)
+            if entry is None:
+                self.entries[driver] = {'driver': driver, 'last_time': lap_time, 'best_time': lap_time}
+                key = (lap_time, driver)
+                bisect.insort(self.order, key)
+                return LeaderboardChange(driver, None, bisect.bisect_left(self.order, key) + 1)
+
+            entry['last_time'] = lap_time
+            old_key = (entry['best_time'], driver)
+            old_index = bisect.bisect_left(self.order, old_key)
+            if lap_time >= entry['best_time']:
+                return LeaderboardChange(driver, old_index + 1, old_index + 1)
+
+            entry['best_time'] = lap_time
+            new_key = (lap_time, driver)
+            new_index = bisect.bisect_left(self.order, new_key, 0, old_index)
+            # A faster best can only move the driver up, so shift the entries in between down by one
+            self.order[new_index + 1:old_index + 1] = self.order[new_index:old_index]
+            self.order[new_index] = new_key
+            return LeaderboardChange(driver, old_index + 1, new_index + 1)
+
+    def remove(self, driver):
+        with self.lock:
+            entry = self.entries.pop(driver, None)
+            if entry is None:
+                return None
+            index = bisect.bisect_left(self.order, (entry['best_time'], driver))
+            del self.order[index]
+            return LeaderboardChange(driver, index + 1, None)
+
+    def ranked(self, start=0, stop=None):
+        # Result dicts in rank order, optionally only the slice [start, stop)
+        with self.lock:
+            return [self.entries[driver] for _, driver in self.order[start:stop]]
+
+    def results(self):
+        return self.ranked()
@@ -0,0 +1,132 @@
+import tkinter as tk
+from tkinter import ttk
+
+LEADERBOARD_COLUMNS = ("Rank", "Driver", "Last Lap", "Best Lap")
+LEADERBOARD_HEADINGS = {"Rank": "Pos", "Driver": "Driver", "Last Lap": "Last Lap (s)", "Best Lap": "Best Lap (s)"}
+
+
+class LeaderboardView(ttk.Frame):
+    # A Treeview that only holds the rows that fit on screen. Its items are
+    # display slots rather than drivers: scrolling, a lap or a font change
+    # rewrites the values in those few slots, so the cost of a refresh does not
+    # grow with the number of drivers. mode is 'scroll' (scrollbar and mouse
+    # wheel), 'top' (ranks 1 to N, N being what fits) or 'paged' (the big
+    # screen steps through the leaderboard one screen every page_interval ms).
+    MODES = ('scroll', 'top', 'paged')
+
+    def __init__(self, master, leaderboard, style, widths, height=10, mode='scroll', page_interval=8000, **kwargs):
+        super().__init__(master, **kwargs)
+        self.leaderboard = leaderboard
+        self.style = style
+        self.mode = mode
+        self.page_interval = page_interval
+        self.page_timer = None
+        self.top = 0
+        self.visible = height
+        self.shown = []  # (driver, values, tags) per slot as last drawn
+
+        self.tree = ttk.Treeview(self, columns=LEADERBOARD_COLUMNS, show='headings', style=style, height=height, selectmode='none')
+        for column in LEADERBOARD_COLUMNS:
+            self.tree.heading(column, text=LEADERBOARD_HEADINGS[column])
+            self.tree.column(column, anchor=tk.CENTER, width=widths[column])
+        self.tree.tag_configure('oddrow', background='white')
+        self.tree.tag_configure('evenrow', background='#f0f0f0')
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.on_scrollbar)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.tree.bind("<Configure>", lambda event: self.relayout())
+        self.tree.bind("<MouseWheel>", lambda event: self.scroll(-1 if event.delta > 0 else 1))
+        self.tree.bind("<Button-4>", lambda event: self.scroll(-1))
+        self.tree.bind("<Button-5>", lambda event: self.scroll(1))
+        self.set_mode(mode)
+
+    def row_height(self):
+        try:
+            return int(ttk.Style().lookup(self.style, 'rowheight') or 20)
+        except (tk.TclError, ValueError):
+            return 20
+
+    def relayout(self):
+        # How many rows fit depends on the window size and the style's row height
+        height = self.tree.winfo_height()
+        if height <= 1:
+            return
+        row_height = self.row_height()
+        children = self.tree.get_children()
+        heading = self.tree.bbox(children[0])[1] if children and self.tree.bbox(children[0]) else row_height
+        self.visible = max(1, (height - heading) // row_height)
+        self.refresh()
+
+    def set_font(self, font, row_height):
+        # Only the style changes; the slots are redrawn from the same leaderboard
+        ttk.Style().configure(self.style, font=font, rowheight=row_height)
+        ttk.Style().configure(f"{self.style}.Heading", font=font)
+        self.relayout()
+
+    def set_mode(self, mode):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown leaderboard mode: {mode}")
+        self.mode = mode
+        if self.page_timer is not None:
+            self.after_cancel(self.page_timer)
+            self.page_timer = None
+        if mode == 'scroll':
+            self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        else:
+            self.scrollbar.pack_forget()
+            self.top = 0
+        if mode == 'paged':
+            self.page_timer = self.after(self.page_interval, self.next_page)
+        self.refresh()
+
+    def next_page(self):
+        self.top += self.visible
+        if self.top >= len(self.leaderboard):
+            self.top = 0
+        self.refresh()
+        self.page_timer = self.after(self.page_interval, self.next_page)
+
+    def scroll(self, rows):
+        if self.mode != 'scroll':
+            return
+        self.top = max(0, min(self.top + rows, len(self.leaderboard) - self.visible))
+        self.refresh()
+
+    def on_scrollbar(self, action, amount, unit=None):
+        total = len(self.leaderboard)
+        if action == 'moveto':
+            self.top = int(float(amount) * total)
+            self.scroll(0)
+        elif action == 'scroll':
+            self.scroll(int(amount) * (self.visible if unit == 'pages' else 1))
+
+    def refresh(self, first_rank=1, last_rank=None):
+        # Tk thread only. Ranks outside the visible window are skipped unless
+        # the leaderboard grew or shrank, which shifts what is on screen.
+        total = len(self.leaderboard)
+        if self.mode == 'scroll':
+            self.top = max(0, min(self.top, total - self.visible))
+        if self.mode == 'scroll' and total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + self.visible) / total))
+        rows = self.leaderboard.ranked(self.top, self.top + self.visible)
+        if last_rank is not None and len(rows) == len(self.shown) and (last_rank <= self.top or first_rank > self.top + len(rows)):
+            return
+
+        for slot, result in enumerate(rows):
+            rank = self.top + slot + 1
+            values = (rank, result['driver'], f"{result['last_time']:.3f}", f"{result['best_time']:.3f}")
+            tags = ('oddrow' if rank % 2 == 0 else 'evenrow',)
+            if slot == len(self.shown):
+                self.tree.insert("", tk.END, iid=str(slot), values=values, tags=tags)
+                self.shown.append((result['driver'], values, tags))
+            elif self.shown[slot][1] != values or self.shown[slot][2] != tags:
+                self.tree.item(str(slot), values=values, tags=tags)
+                self.shown[slot] = (result['driver'], values, tags)
+        while len(self.shown) > len(rows):
+            self.shown.pop()
+            self.tree.delete(str(len(self.shown)))
+
+    def driver_at(self, y):
+        slot = self.tree.identify_row(y)
+        return self.shown[int(slot)][0] if slot else None
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import atexit
+import queue
+import logging
+import logging.handlers
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Lap and serial events for replay tools, one JSON object per line. Off unless
+# setup_logging is given an events_filename, and then log_event costs one
+# record on a queue for the calling thread.
+events_logger = logging.getLogger('slotcar.events')
+events_logger.propagate = False
+events_logger.disabled = True
+
+
+class RotatingLogHandler(logging.handlers.RotatingFileHandler):
+    # Rolls over when the file reaches max_bytes or has been open for interval
+    # seconds, whichever comes first, keeping backup_count numbered old files
+    def __init__(self, filename, max_bytes, backup_count, interval):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval if interval else None
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and record.created >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    # The stock QueueHandler formats the message before queueing it; here the
+    # record goes on the queue as it is and the listener thread does all the
+    # formatting and file writing
+    def prepare(self, record):
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+    # The caller's fields are written as given; event and logged_at are not
+    # field names log_event callers use, so a lap's time is never overwritten
+    def format(self, record):
+        return json.dumps(dict({'event': record.msg, 'logged_at': record.created}, **getattr(record, 'fields', {})))
+
+
+def log_event(event, **fields):
+    if events_logger.disabled:
+        return
+    events_logger.info(event, extra={'fields': fields})
+
+
+def setup_logging(filename, level=logging.DEBUG, max_bytes=5 * 1024 * 1024, backup_count=5,
+                  rotate_hours=24, events_filename=None):
+    # Every thread only puts records on a queue; one listener thread writes
+    # them. The listener is flushed and stopped when the interpreter exits.
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    records = queue.SimpleQueue()
+    # Nothing logs the process ids, so do not look them up for every record
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    file_handler = RotatingLogHandler(filename, max_bytes, backup_count, rotate_hours * 3600)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handlers = [file_handler]
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(RecordQueueHandler(records))
+
+    if events_filename:
+        event_handler = RotatingLogHandler(events_filename, max_bytes, backup_count, rotate_hours * 3600)
+        event_handler.setFormatter(JsonLinesFormatter())
+        # Routed by logger name, so the event lines never reach the text log and vice versa
+        event_handler.addFilter(lambda record: record.name == events_logger.name)
+        file_handler.addFilter(lambda record: record.name != events_logger.name)
+        handlers.append(event_handler)
+        events_logger.setLevel(logging.INFO)
+        events_logger.addHandler(RecordQueueHandler(records))
+        events_logger.disabled = False
+
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def setup_logging_from_settings(settings, filename):
+    # settings.json keys: log_level, log_max_mb, log_backups, log_rotate_hours and event_log
+    level = getattr(logging, str(settings.get('log_level', 'DEBUG')).upper(), logging.DEBUG)
+    events_filename = os.path.join(os.path.dirname(filename), 'events.jsonl') if settings.get('event_log') else None
+    return setup_logging(filename, level, int(settings.get('log_max_mb', 5) * 1024 * 1024), settings.get('log_backups', 5),
+                         settings.get('log_rotate_hours', 24), events_filename)
+
+
+def check_event_round_trip():
+    # A lap event must come back out of events.jsonl with its own fields intact
+    fields = {'race': 'check', 'lane': 1, 'driver': 'Check', 'lap': 1, 'time': 4.321, 'penalty': 0,
+              'reaction': None, 'timestamp': 123}
+    record = logging.LogRecord(events_logger.name, logging.INFO, __file__, 0, 'lap', None, None)
+    record.fields = fields
+    line = json.loads(JsonLinesFormatter().format(record))
+    if line['event'] != 'lap' or any(line.get(name) != value for name, value in fields.items()):
+        raise AssertionError(f"Lap event did not round-trip through the event log: {line}")
+    return line
+
+
+if __name__ == "__main__":
+    print(json.dumps(check_event_round_trip()))
@@ -1,89 +1,208 @@
 import tkinter as tk
 import customtkinter as ctk
 from tkinter import ttk, messagebox
-import threading
 import time
 import os
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
-import pygame
 import sys
-import serial
-import random
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+import queue
 import logging
 
-from camera import open_camera_window
 from data_manager import load_data, save_data
-
-log_folder = 'logs'
-os.makedirs(log_folder, exist_ok=True)
-logging.basicConfig(
-    filename=os.path.join(log_folder, 'project_slotcar.log'),
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-
-class ScrollableRadiobuttonFrame(ctk.CTkScrollableFrame):
-    def __init__(self, master, item_list, command=None, **kwargs):
-        super().__init__(master, **kwargs)
-
-        self.command = command
-        self.radiobutton_variable = ctk.StringVar()
-        self.radiobutton_list = []
-        for i, item in enumerate(item_list):
-            self.add_item(item)
-
-    def add_item(self, item):
-        radiobutton = ctk.CTkRadioButton(self, text=item, value=item, variable=self.radiobutton_variable)
-        if self.command is not None:
-            radiobutton.configure(command=self.command)
-        radiobutton.grid(row=len(self.radiobutton_list), column=0, pady=(0, 10))
-        self.radiobutton_list.append(radiobutton)
-
-    def remove_item(self, item):
-        for radiobutton in self.radiobutton_list:
-            if item == radiobutton.cget("text"):
-                radiobutton.destroy()
-                self.radiobutton_list.remove(radiobutton)
-                return
-
-    def get_checked_item(self):
-        return self.radiobutton_variable.get()
+from leaderboard import LeaderboardChange
+from leaderboard_view import LeaderboardView
+from driver_list import DriverList
+from roster import Roster
+from sound_bank import SoundBank
+from race_control import RaceControl
+from log_setup import setup_logging_from_settings
+import instrumentation
+
+class HeatSetupWindow(ctk.CTkToplevel):
+    NO_DRIVER = "-"
+    # Typing in a lane box narrows its drop-down to this many matching drivers
+    MAX_SUGGESTIONS = 20
+
+    def __init__(self, app, lane_count, roster, **kwargs):
+        super().__init__(app.root, **kwargs)
+        self.app = app
+        self.roster = roster
+        self.title("Multi-Lane Heat")
+        self.lane_menus = {}
+
+        for lane in range(1, lane_count + 1):
+            label = ctk.CTkLabel(self, text=f"Lane {lane}:")
+            label.grid(row=lane, column=0, pady=5, padx=5)
+            menu = ctk.CTkComboBox(self, values=self.suggestions(""))
+            menu.set(self.NO_DRIVER)
+            menu.bind("<KeyRelease>", lambda event, menu=menu: menu.configure(values=self.suggestions(menu.get())))
+            menu.grid(row=lane, column=1, pady=5, padx=5)
+            self.lane_menus[lane] = menu
+            disqualify_button = ctk.CTkButton(self, text="Disqualify", width=90, command=lambda lane=lane: app.disqualify(lane), fg_color='#dc3545', text_color='white')
+            disqualify_button.grid(row=lane, column=2, pady=5, padx=5)
+
+        self.start_button = ctk.CTkButton(self, text="Start Heat", command=self.start_heat, fg_color='#28a745', text_color='white')
+        self.start_button.grid(row=lane_count + 1, column=0, columnspan=3, pady=10, padx=5, sticky="nsew")
+
+    def suggestions(self, text):
+        text = "" if text == self.NO_DRIVER else text
+        return [self.NO_DRIVER] + self.roster.search(text)[:self.MAX_SUGGESTIONS]
+
+    def get_lane_drivers(self):
+        return {lane: menu.get().strip() for lane, menu in self.lane_menus.items() if menu.get().strip() not in (self.NO_DRIVER, "")}
+
+    def start_heat(self):
+        lane_drivers = self.get_lane_drivers()
+        if not lane_drivers:
+            messagebox.showerror("Error", "Assign a driver to at least one lane.", parent=self)
+            logging.warning("Attempted to start heat with no drivers assigned")
+            return
+        if len(set(lane_drivers.values())) != len(lane_drivers):
+            messagebox.showerror("Error", "A driver can only race in one lane.", parent=self)
+            logging.warning("Attempted to start heat with a driver in several lanes")
+            return
+        unknown = [driver for driver in lane_drivers.values() if driver not in self.roster]
+        if unknown:
+            messagebox.showerror("Error", f"Unknown driver: {unknown[0]}", parent=self)
+            logging.warning(f"Attempted to start heat with unknown driver {unknown[0]}")
+            return
+        self.app.start_heat(lane_drivers)
+
+class DiagnosticsWindow(ctk.CTkToplevel):
+    # Live view of the instrumentation spans and counters, refreshed once a second
+    COLUMNS = ("Name", "Count", "p50", "p95", "p99", "Max")
+
+    def __init__(self, app, **kwargs):
+        super().__init__(app.root, **kwargs)
+        self.app = app
+        self.title("Diagnostics")
+
+        self.enabled_switch = ctk.CTkSwitch(self, text="Collect timings", command=self.toggle)
+        if instrumentation.enabled:
+            self.enabled_switch.select()
+        self.enabled_switch.grid(row=0, column=0, pady=5, padx=5)
+        self.reset_button = ctk.CTkButton(self, text="Reset", command=self.reset)
+        self.reset_button.grid(row=0, column=1, pady=5, padx=5)
+        self.dump_button = ctk.CTkButton(self, text="Dump to File", command=self.dump)
+        self.dump_button.grid(row=0, column=2, pady=5, padx=5)
+
+        self.table = ttk.Treeview(self, columns=self.COLUMNS, show='headings', height=12)
+        for column in self.COLUMNS:
+            self.table.heading(column, text=column if column in ("Name", "Count") else f"{column} (ms)")
+            self.table.column(column, anchor=tk.W if column == "Name" else tk.CENTER, width=220 if column == "Name" else 90)
+        self.table.grid(row=1, column=0, columnspan=3, pady=10, padx=10, sticky="nsew")
+        self.refresh()
+
+    def toggle(self):
+        instrumentation.enable(self.enabled_switch.get())
+        self.app.save_settings()
+        logging.info(f"Instrumentation {'enabled' if instrumentation.enabled else 'disabled'}")
+
+    def reset(self):
+        instrumentation.reset()
+        self.table.delete(*self.table.get_children())
+
+    def dump(self):
+        filename = os.path.join('logs', f"metrics_{time.strftime('%Y%m%d-%H%M%S')}.json")
+        try:
+            instrumentation.dump(filename)
+            messagebox.showinfo("Diagnostics", f"Timings written to {filename}", parent=self)
+            logging.info(f"Instrumentation dumped to {filename}")
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to write timings: {str(e)}", parent=self)
+            logging.error(f"Failed to write timings: {str(e)}")
+
+    def refresh(self):
+        if not self.winfo_exists():
+            return
+        metrics = instrumentation.snapshot()
+        for name, span in metrics['spans'].items():
+            values = (name, span['count'], f"{span['p50_ms']:.3f}", f"{span['p95_ms']:.3f}", f"{span['p99_ms']:.3f}", f"{span['max_ms']:.3f}")
+            if self.table.exists(name):
+                self.table.item(name, values=values)
+            else:
+                self.table.insert("", tk.END, iid=name, values=values)
+        for name, total in metrics['counters'].items():
+            iid = f"counter:{name}"
+            values = (name, total, "", "", "", "")
+            if self.table.exists(iid):
+                self.table.item(iid, values=values)
+            else:
+                self.table.insert("", tk.END, iid=iid, values=values)
+        self.after(1000, self.refresh)
 
 class SlotCarManager(ctk.CTk):
+    # Host clock stamps each trigger on arrival; device clock uses the "1,<micros>" counter sent by the track
+    TIMING_MODES = {"Host Clock": 'host', "Device Clock": 'device'}
+    # Which sensor counts laps; the cross-check counts serial laps and flags crossings only the camera saw
+    LAP_SENSORS = {"Serial Sensor": 'serial', "Camera Sensor": 'camera', "Serial + Camera Check": 'cross-check'}
+    # Flat charges early_start_penalty for every jump start; graded charges less the closer it was to GO
+    PENALTY_MODES = {"Flat Penalty": 'flat', "Graded Penalty": 'graded'}
+    # How the pop-out results window shows a leaderboard longer than the screen
+    RESULTS_VIEW_MODES = {"Scroll": 'scroll', "Top N": 'top', "Pages": 'paged'}
+    # A workbook with a sheet each, or one CSV file per sheet
+    REPORT_FORMATS = {"Excel": 'xlsx', "CSV": 'csv'}
+
     def __init__(self, root):
         super().__init__()
         self.root = root
         self.root.title("Project Slotcar")
 
-        self.drivers = load_data('drivers.json', 1)
-        self.results = load_data('results.json', 1)
+        self.roster = Roster(load_data('drivers.json', 1))
         settings = load_data('settings.json', 0)
-        self.serial_port = settings.get('serial_port', 'COM3')
-        self.early_start_penalty = settings.get('early_start_penalty', 2)
+        # Sounds are loaded once the window has drawn instead of holding up startup
+        self.sound_bank = SoundBank(self.get_data_path('sounds'))
+        self.control = RaceControl(settings, self.sound_bank)
+        self.control.listeners.append(self.on_race_event)
+        self.leaderboard = self.control.leaderboard
         self.results_table2 = None
+        self.results_view_mode = settings.get('results_view_mode', 'scroll')
         self.results_window = None
         self.overlay_label = None
 
         self.debounce_interval = 500  # milliseconds
         self.debounce_timer = None
 
-        self.disqualified = False
+        self.heat_window = None
+        self.diagnostics_window = None
+        self.season_report = None
+        self.race_server = None
+
+        # (kind, data) race events from other threads, applied on the Tk thread by process_ui_updates
+        self.ui_updates = queue.Queue()
+        self.ui_update_interval = 16  # milliseconds, about one repaint per frame
 
         self.create_widgets()
-        pygame.mixer.init()
+        self.root.after_idle(self.sound_bank.load_in_background)
+        self.root.after_idle(self.control.load_history_in_background)
+
+        # Spectator displays connect to the race server when a port is configured
+        self.race_server_host = settings.get('race_server_host', '127.0.0.1')
+        self.race_server_token = settings.get('race_server_token')
+        if settings.get('race_server_port'):
+            self.start_race_server(settings['race_server_port'])
 
         self.save_settings()
+        self.root.after(self.ui_update_interval, self.process_ui_updates)
         logging.info("SlotCarManager initialized")
 
     def save_settings(self):
-        settings = {
-            'serial_port': self.serial_port,
-            'early_start_penalty': self.early_start_penalty
-        }
+        # Merged into the file so keys owned by other windows, like the camera cache, survive
+        settings = load_data('settings.json', 0)
+        settings.update(self.control.settings())
+        settings['results_view_mode'] = self.results_view_mode
+        settings['instrumentation'] = instrumentation.enabled
         save_data('settings.json', settings)
 
+    def start_race_server(self, port):
+        try:
+            from race_server import RaceServer
+            # Local only unless race_server_host opts in to serving the LAN
+            self.race_server = RaceServer(self.control, self.race_server_host, port, self.race_server_token)
+            self.race_server.start()
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to start race server: {str(e)}")
+            logging.error(f"Failed to start race server: {str(e)}")
+
     def create_widgets(self):
         frame = ctk.CTkFrame(self.root, corner_radius=10)
         frame.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
@@ -99,10 +218,10 @@ class SlotCarManager(ctk.CTk):
 
         self.remove_driver_button = ctk.CTkButton(frame, text="Remove Driver", command=self.remove_driver, fg_color='#dc3545', text_color='white')
         self.remove_driver_button.grid(row=0, column=3, pady=5, padx=5)
-        
-        self.scrollable_radiobutton_frame = ScrollableRadiobuttonFrame(master=self, width=200,
-                                                                       item_list=self.drivers)
-        self.scrollable_radiobutton_frame.grid(row=1, column=0, columnspan=4, pady=10, sticky="nsew")
+
+        # Only the rows on screen exist as radio buttons, however many drivers register
+        self.driver_list = DriverList(frame, self.roster, width=200)
+        self.driver_list.grid(row=1, column=0, columnspan=4, pady=10, sticky="nsew")
 
         self.laps_label = ctk.CTkLabel(frame, text="Number of Laps:")
         self.laps_label.grid(row=2, column=0, pady=5)
@@ -116,31 +235,39 @@ class SlotCarManager(ctk.CTk):
         self.laps_entry = ctk.CTkEntry(frame)
         self.laps_entry.grid(row=2, column=1, pady=5)
 
-        self.scrollable_radiobutton_frame = ScrollableRadiobuttonFrame(master=frame, width=200, item_list=self.drivers)
-        self.scrollable_radiobutton_frame.grid(row=1, column=0, columnspan=4, pady=10, sticky="nsew")
-
         self.port_label = ctk.CTkLabel(frame, text="Serial Port:")
         self.port_label.grid(row=3, column=0, pady=5)
 
         self.port_entry = ctk.CTkEntry(frame)
-        self.port_entry.insert(0, self.serial_port)
+        self.port_entry.insert(0, self.control.serial_port)
         self.port_entry.grid(row=3, column=1, pady=5)
 
         self.set_port_button = ctk.CTkButton(frame, text="Set Port", command=self.set_serial_port)
         self.set_port_button.grid(row=3, column=2, pady=5, padx=5)
 
+        self.timing_mode_menu = ctk.CTkOptionMenu(frame, values=list(self.TIMING_MODES), command=self.set_timing_mode)
+        self.timing_mode_menu.set("Device Clock" if self.control.timing_mode == 'device' else "Host Clock")
+        self.timing_mode_menu.grid(row=3, column=3, pady=5, padx=5)
+
         self.penalty_label = ctk.CTkLabel(frame, text="Early Start Penalty (s):")
         self.penalty_label.grid(row=4, column=0, pady=5)
 
         self.penalty_entry = ctk.CTkEntry(frame)
-        self.penalty_entry.insert(0, str(self.early_start_penalty))
+        self.penalty_entry.insert(0, str(self.control.early_start_penalty))
         self.penalty_entry.grid(row=4, column=1, pady=5)
 
         self.set_penalty_button = ctk.CTkButton(frame, text="Set Penalty", command=self.set_early_start_penalty)
         self.set_penalty_button.grid(row=4, column=2, pady=5, padx=5)
 
+        self.heat_button = ctk.CTkButton(frame, text="Multi-Lane Heat", command=self.show_heat_setup)
+        self.heat_button.grid(row=4, column=3, pady=5, padx=5)
+
         self.countdown_label = ctk.CTkLabel(frame, text="", font=("Helvetica", 16))
-        self.countdown_label.grid(row=5, column=0, columnspan=4, pady=10)
+        self.countdown_label.grid(row=5, column=0, columnspan=3, pady=10)
+
+        self.penalty_mode_menu = ctk.CTkOptionMenu(frame, values=list(self.PENALTY_MODES), command=self.set_penalty_mode)
+        self.penalty_mode_menu.set("Graded Penalty" if self.control.penalty_mode == 'graded' else "Flat Penalty")
+        self.penalty_mode_menu.grid(row=5, column=3, pady=5, padx=5)
 
         self.results_button = ctk.CTkButton(frame, text="Show Results", command=self.show_results)
         self.results_button.grid(row=6, column=0, sticky="nsew", pady=10, padx=(10,10))
@@ -149,42 +276,68 @@ class SlotCarManager(ctk.CTk):
         self.font_size_slider.set(10)  # Set default value
         self.font_size_slider.grid(row=6, column=1, sticky="nsew", pady=10, padx=(10,10))
 
-        self.open_camera_button = ctk.CTkButton(frame, text="Open Camera", command=lambda: threading.Thread(target=open_camera_window).start())
+        self.open_camera_button = ctk.CTkButton(frame, text="Open Camera", command=self.open_camera)
         self.open_camera_button.grid(row=6, column=2, sticky="nsew", pady=10, padx=(10,10))
 
-        self.results_table = ttk.Treeview(frame, columns=("Rank", "Driver", "Last Lap", "Best Lap"), show='headings', style="Custom.Treeview")
-        self.results_table.heading("Rank", text="Pos")
-        self.results_table.heading("Driver", text="Driver")
-        self.results_table.heading("Last Lap", text="Last Lap (s)")
-        self.results_table.heading("Best Lap", text="Best Lap (s)")
-        self.results_table.column("Rank", anchor=tk.CENTER, width=50)
-        self.results_table.column("Driver", anchor=tk.CENTER, width=250)
-        self.results_table.column("Last Lap", anchor=tk.CENTER, width=150)
-        self.results_table.column("Best Lap", anchor=tk.CENTER, width=150)
+        self.lap_sensor_menu = ctk.CTkOptionMenu(frame, values=list(self.LAP_SENSORS), command=self.set_lap_sensor)
+        self.lap_sensor_menu.set(next((label for label, sensor in self.LAP_SENSORS.items() if sensor == self.control.lap_sensor), "Serial Sensor"))
+        self.lap_sensor_menu.grid(row=6, column=3, sticky="nsew", pady=10, padx=(10,10))
+
+        # Only the rows on screen exist as Treeview items, however long the season gets
+        self.results_table = LeaderboardView(frame, self.leaderboard, "Custom.Treeview",
+                                             {"Rank": 50, "Driver": 250, "Last Lap": 150, "Best Lap": 150})
         self.results_table.grid(row=7, column=0, columnspan=4, pady=10, sticky="nsew")
+
+        self.export_button = ctk.CTkButton(frame, text="Export Season", command=self.export_results_to_excel)
+        self.export_button.grid(row=8, column=0, pady=5, padx=5)
+
+        self.report_format_menu = ctk.CTkOptionMenu(frame, values=list(self.REPORT_FORMATS))
+        self.report_format_menu.set("Excel")
+        self.report_format_menu.grid(row=8, column=1, pady=5, padx=5)
+
+        self.export_progress = ctk.CTkProgressBar(frame)
+        self.export_progress.set(0)
+        self.export_progress.grid(row=8, column=2, pady=5, padx=5)
+
+        self.diagnostics_button = ctk.CTkButton(frame, text="Diagnostics", command=self.show_diagnostics)
+        self.diagnostics_button.grid(row=8, column=3, pady=5, padx=5)
         self.update_results_table()
         logging.info("Widgets created")
 
-    def disqualify(self):
-        self.disqualified = True
-        logging.info("Driver disqualified")
+    def disqualify(self, lane=None):
+        self.control.disqualify(lane)
 
     def set_serial_port(self):
         try:
-            self.serial_port = self.port_entry.get()
+            self.control.set_serial_port(self.port_entry.get())
             self.save_settings()
-            messagebox.showinfo("Serial Port Set", f"Serial port set to {self.serial_port}")
-            logging.info(f"Serial port set to {self.serial_port}")
+            messagebox.showinfo("Serial Port Set", f"Serial port set to {self.control.serial_port}")
+            logging.info(f"Serial port set to {self.control.serial_port}")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to set serial port: {str(e)}")
             logging.error(f"Failed to set serial port: {str(e)}")
 
+    def set_timing_mode(self, label):
+        self.control.timing_mode = self.TIMING_MODES[label]
+        self.save_settings()
+        logging.info(f"Timing mode set to {self.control.timing_mode}")
+
+    def set_lap_sensor(self, label):
+        self.control.lap_sensor = self.LAP_SENSORS[label]
+        self.save_settings()
+        logging.info(f"Lap sensor set to {self.control.lap_sensor}")
+
+    def set_penalty_mode(self, label):
+        self.control.penalty_mode = self.PENALTY_MODES[label]
+        self.save_settings()
+        logging.info(f"Penalty mode set to {self.control.penalty_mode}")
+
     def set_early_start_penalty(self):
         try:
-            self.early_start_penalty = int(self.penalty_entry.get())
+            self.control.early_start_penalty = int(self.penalty_entry.get())
             self.save_settings()
-            messagebox.showinfo("Penalty Set", f"Early start penalty set to {self.early_start_penalty} seconds")
-            logging.info(f"Early start penalty set to {self.early_start_penalty} seconds")
+            messagebox.showinfo("Penalty Set", f"Early start penalty set to {self.control.early_start_penalty} seconds")
+            logging.info(f"Early start penalty set to {self.control.early_start_penalty} seconds")
         except ValueError:
             messagebox.showerror("Error", "Invalid penalty value. Please enter an integer.")
             logging.error("Invalid penalty value entered")
@@ -193,10 +346,10 @@ class SlotCarManager(ctk.CTk):
         try:
             driver_name = self.driver_entry.get()
             if driver_name:
-                if driver_name not in self.drivers:
-                    self.drivers.append(driver_name)
-                    self.scrollable_radiobutton_frame.add_item(driver_name)
-                    save_data('drivers.json', self.drivers)
+                if self.roster.add(driver_name):
+                    save_data('drivers.json', self.roster.names())
+                    self.driver_list.refresh()
+                    self.driver_list.show(driver_name)
                     self.driver_entry.delete(0, tk.END)
                 else:
                     messagebox.showerror("Error", "Driver name already exists.")
@@ -210,18 +363,16 @@ class SlotCarManager(ctk.CTk):
 
     def remove_driver(self):
         try:
-            selected_driver = self.scrollable_radiobutton_frame.get_checked_item()
+            selected_driver = self.driver_list.get_checked_item()
             if selected_driver:
                 driver_name = selected_driver
                 confirm = messagebox.askyesno("Confirm Deletion", f"Are you sure you want to remove {driver_name}?")
                 if confirm:
-                    self.drivers.remove(driver_name)
-                    self.scrollable_radiobutton_frame.remove_item(driver_name)
-                    self.results = [result for result in self.results if result['driver'] != driver_name]
-                    save_data('drivers.json', self.drivers)
-                    save_data('results.json', self.results)
+                    self.roster.remove(driver_name)
+                    save_data('drivers.json', self.roster.names())
+                    self.driver_list.refresh()
+                    self.control.remove_driver(driver_name)
                     messagebox.showinfo("Success", f"Driver {driver_name} removed.")
-                    self.update_results_table()
             else:
                 messagebox.showerror("Error", "No driver selected.")
                 logging.warning("Attempted to remove driver with no selection")
@@ -244,25 +395,26 @@ class SlotCarManager(ctk.CTk):
             return None
         
     def show_overlay(self, text):
-        if self.overlay_label:
-            self.overlay_label.destroy()
-        if self.results_table2:
+        self.hide_overlay()
+        # The results window may have been closed, destroying the table with it
+        if self.results_table2 and self.results_table2.winfo_exists():
             self.overlay_label = ctk.CTkLabel(self.results_table2, text=text, font=("Helvetica", 128, "bold"), fg_color='#ffffff', text_color='#000000')
             self.overlay_label.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
 
     def hide_overlay(self):
         if self.overlay_label:
-            self.overlay_label.destroy()
+            if self.overlay_label.winfo_exists():
+                self.overlay_label.destroy()
             self.overlay_label = None
 
     def start_race(self):
         try:
-            selected_driver = self.scrollable_radiobutton_frame.get_checked_item()
+            selected_driver = self.driver_list.get_checked_item()
             if selected_driver:
                 driver = selected_driver
                 laps = self.get_number_of_laps()
                 if driver and laps:
-                    threading.Thread(target=self.countdown, args=(5, driver, laps)).start()  # 5 second countdown
+                    self.control.start_heat({1: driver}, laps, 5)  # 5 second countdown
             else:
                 logging.warning("Attempted to start race with no driver selected")
                 messagebox.showerror("Error", "No driver selected.")
@@ -270,14 +422,33 @@ class SlotCarManager(ctk.CTk):
             messagebox.showerror("Error", f"Failed to start race: {str(e)}")
             logging.error(f"Failed to start race: {str(e)}")
 
-    def play_sound(self, second):
+    def show_heat_setup(self):
+        if self.heat_window and self.heat_window.winfo_exists():
+            self.heat_window.lift()
+            return
+        self.heat_window = HeatSetupWindow(self, self.control.lane_count, self.roster)
+        logging.info("Heat setup window created")
+
+    def show_diagnostics(self):
+        if self.diagnostics_window and self.diagnostics_window.winfo_exists():
+            self.diagnostics_window.lift()
+            return
+        self.diagnostics_window = DiagnosticsWindow(self)
+        logging.info("Diagnostics window created")
+
+    def open_camera(self):
+        # OpenCV is only loaded once a camera is actually wanted
+        from camera import open_camera_window
+        open_camera_window(self.control.race_events, self.control.lane_count, self.control.lap_listeners)
+
+    def start_heat(self, lane_drivers):
         try:
-            sound_folder_path = self.get_data_path('sounds')
-            sound_file = f"{sound_folder_path}/{second}.wav"
-            pygame.mixer.Sound(sound_file).play()
+            laps = self.get_number_of_laps()
+            if laps:
+                self.control.start_heat(lane_drivers, laps, 5)  # 5 second countdown
         except Exception as e:
-            print(f"Failed to play sound: {str(e)}")
-            logging.error(f"Failed to play sound: {str(e)}")
+            messagebox.showerror("Error", f"Failed to start heat: {str(e)}")
+            logging.error(f"Failed to start heat: {str(e)}")
 
     def get_data_path(self,relative_path):
         if getattr(sys, 'frozen', False):
@@ -289,119 +460,88 @@ class SlotCarManager(ctk.CTk):
 
         return os.path.join(base_path, relative_path)
 
-    def countdown(self, seconds, driver, laps):
-        try:
-            with serial.Serial(self.serial_port, 9600, timeout=1) as ser:
-                next = seconds
-                counter = 0
-                self.disqualified = False
-                for second in range((seconds + 1) * 100, 0, -1):
-                    time.sleep(0.01)
-                    check_early = False
-                    if ser.in_waiting > 0:
-                        line = ser.readline().decode('utf-8').strip()
-                        if line == '1':
-                            check_early = True
-                    if check_early:
-                        ser.close()
-                        self.show_overlay("Early Start!")
-                        self.countdown_label.configure(text="Early Start!")
-                        self.play_sound(f"false_start/{random.randint(1, 3)}")
-                        self.run_race(driver, laps, True, True)
-                        return
-                    counter = counter + 1
-                    if counter >= 100 and next > 0:
-                        counter = 0
-                        self.show_overlay(next)
-                        self.countdown_label.configure(text=f"Stage starts in: {next}")
-                        self.play_sound(f"countdown/{next}")
-                        next = next - 1
-                self.show_overlay("Go!")
-                self.play_sound("countdown/GO")
-                ser.close()
-                self.run_race(driver, laps, False, False)
-        except Exception as e:
-            messagebox.showerror("Error", f"Serial communication error: {str(e)}")
-            logging.error(f"Serial communication error: {str(e)}")
-            return False
-
-    def run_race(self, driver, laps, early_start, count_first):
-        try:
+    def on_race_event(self, kind, data):
+        # Race thread: nothing here touches Tk, the event is queued for process_ui_updates
+        if kind == 'leaderboard':
+            self.queue_results_update(LeaderboardChange(data['driver'], data['old_rank'], data['new_rank']))
+        else:
+            self.ui_updates.put((kind, data))
+
+    def apply_race_event(self, kind, data):
+        # Tk thread only, called from process_ui_updates
+        if kind == 'countdown':
+            self.show_overlay(data['number'])
+            self.countdown_label.configure(text=f"Stage starts in: {data['number']}")
+        elif kind == 'early_start':
+            self.show_overlay("Early Start!")
+            self.countdown_label.configure(text=f"Early Start! ({data['driver']})")
+        elif kind == 'go':
+            self.show_overlay("Go!")
             self.countdown_label.configure(text="")
-            lap_times = []
-            lap_count = 0
-            count_first_temp = count_first
-            logging.info("Started race...")
-                
-            while lap_count < laps:
-                lap_start = time.time()
-                lap_end = None
-                with serial.Serial(self.serial_port, 9600, timeout=1) as ser:
-                    while True:
-                        if ser.in_waiting > 0:
-                            line = ser.readline().decode('utf-8').strip()
-                            if line == '1':
-                                if count_first_temp:
-                                    lap_end = time.time()
-                                    break
-                                else:
-                                    count_first_temp = True
-                        if self.disqualified:
-                            self.disqualified = False
-                            self.play_sound(f"disqualified/{random.randint(1, 3)}")
-                            self.countdown_label.configure(text="Disqualified")
-                            logging.info("Disqualified")
-                            return
-                lap_time = lap_end - lap_start
-                if lap_count == 0 and early_start:
-                    lap_time += self.early_start_penalty
-                lap_times.append(lap_time)
-                lap_count += 1
-                self.hide_overlay()
-                driver_found = False
-                for result in self.results:
-                    if result['driver'] == driver:
-                        result['last_time'] = lap_time
-                        result['best_time'] = min(result['best_time'], lap_time)
-                        driver_found = True
-                        break
-                if not driver_found:
-                    self.results.append({'driver': driver, 'last_time': lap_time, 'best_time': lap_time})
-                save_data('results.json', self.results)
-                self.update_results_table()
-                logging.info("Finished race...")
-                
-            save_data('results.json', self.results)
-            self.update_results_table()
-            self.countdown_label.configure(text="Finished")
-            self.play_sound(f"well_done/{random.randint(1, 3)}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to run race: {str(e)}")
-            logging.error(f"Failed to run race: {str(e)}")
-
-    def update_results_table(self):
+        elif kind == 'lap':
+            self.hide_overlay()
+        elif kind == 'disqualified':
+            self.countdown_label.configure(text=f"Disqualified: {data['driver']}")
+        elif kind == 'finished':
+            self.hide_overlay()
+            if data['disqualified']:
+                self.countdown_label.configure(text="Disqualified")
+            elif data['missed']:
+                lanes = sorted({missed['lane'] for missed in data['missed']})
+                self.countdown_label.configure(text=f"Finished - check the light gate, the camera saw {len(data['missed'])} missed lap(s) in lane {', '.join(map(str, lanes))}")
+            else:
+                # Negative reaction times are jump starts
+                reactions = ", ".join(f"{driver} {reaction:+.3f} s" for driver, reaction in data['reactions'].items())
+                self.countdown_label.configure(text=f"Finished - reaction {reactions or 'not recorded'}")
+        elif kind == 'error':
+            messagebox.showerror("Error", data['message'])
+
+    def queue_results_update(self, change):
+        # Safe from any thread; the Tk thread applies it in process_ui_updates
+        self.ui_updates.put(('leaderboard', change))
+
+    def process_ui_updates(self):
+        # Always reschedule, so one bad update cannot stop the UI from following the race
         try:
-            self.results_table.delete(*self.results_table.get_children())
-            sorted_results = sorted([result for result in self.results if 'best_time' in result], key=lambda x: x['best_time'])
-            font_size = self.font_size_slider.get()
-            row_height = int(font_size * 1.5)
-            
-            style = ttk.Style()
-            style.configure("ResultsWindow.Treeview", rowheight=row_height)
-
-            for index, result in enumerate(sorted_results, start=1):
-                self.results_table.insert("", tk.END, values=(index, result['driver'], f"{result['last_time']:.3f}", f"{result['best_time']:.3f}"), tags=('oddrow' if index % 2 == 0 else 'evenrow'))
-                self.results_table.tag_configure('oddrow', background='white')
-                self.results_table.tag_configure('evenrow', background='#f0f0f0')
+            self.drain_ui_updates()
+        finally:
+            self.root.after(self.ui_update_interval, self.process_ui_updates)
+
+    def drain_ui_updates(self):
+        first_rank = None
+        last_rank = 0
+        while True:
+            try:
+                kind, data = self.ui_updates.get_nowait()
+            except queue.Empty:
+                break
+            if kind != 'leaderboard':
+                try:
+                    self.apply_race_event(kind, data)
+                except Exception as e:
+                    logging.exception(f"Failed to apply race event {kind}: {str(e)}")
+                continue
+            change = data
+            ranks = [rank for rank in (change.old_rank, change.new_rank) if rank is not None]
+            first_rank = min([first_rank] + ranks) if first_rank is not None else min(ranks)
+            if change.old_rank is None or change.new_rank is None:
+                # Arrivals and removals shift every rank below them
+                last_rank = None
+            elif last_rank is not None:
+                last_rank = max([last_rank] + ranks)
+        if first_rank is not None:
+            # A burst of laps is merged into a single repaint of the ranks it touched
+            self.update_results_table(first_rank, last_rank)
+
+    @instrumentation.timed('update_results_table')
+    def update_results_table(self, first_rank=1, last_rank=None):
+        # Tk thread only; race threads use queue_results_update
+        try:
+            self.results_table.refresh(first_rank, last_rank)
             
             if self.results_window:
                 try:
-                    self.results_table2.delete(*self.results_table2.get_children())
-                    sorted_results2 = sorted([result for result in self.results if 'best_time' in result], key=lambda x: x['best_time'])
-                    for index, result in enumerate(sorted_results2, start=1):
-                        self.results_table2.insert("", tk.END, values=(index, result['driver'], f"{result['last_time']:.3f}", f"{result['best_time']:.3f}"), tags=('oddrow' if index % 2 == 0 else 'evenrow'))
-                        self.results_table2.tag_configure('oddrow', background='white')
-                        self.results_table2.tag_configure('evenrow', background='#f0f0f0')
+                    self.results_table2.refresh(first_rank, last_rank)
                 except Exception as e:
                     logging.error(f"Failed to update results table: {str(e)}")
             
@@ -410,7 +550,6 @@ class SlotCarManager(ctk.CTk):
             messagebox.showerror("Error", f"Failed to update results table: {str(e)}")
             logging.error(f"Failed to update results table: {str(e)}")
 
-    
     def get_number_of_laps(self):
         try:
             laps = int(self.laps_entry.get())
@@ -425,53 +564,10 @@ class SlotCarManager(ctk.CTk):
             logging.warning("Invalid laps data type entered")
             return None
 
+    @instrumentation.timed('dump_leaderboard_to_excel')
     def dump_leaderboard_to_excel(self):
-        try:
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Leaderboard"
-
-            headers = ["Rank", "Driver", "Last Lap (s)", "Best Lap (s)"]
-            ws.append(headers)
-
-            for col in ws.iter_cols(min_col=1, max_col=4, min_row=1, max_row=1):
-                for cell in col:
-                    cell.font = Font(bold=True)
-                    cell.alignment = Alignment(horizontal="center")
-                    cell.border = Border(
-                        left=Side(border_style="thin"),
-                        right=Side(border_style="thin"),
-                        top=Side(border_style="thin"),
-                        bottom=Side(border_style="thin")
-                    )
-                    ws.column_dimensions[cell.column_letter].width = 20
-                ws.column_dimensions["A"].width = 10
-                ws.column_dimensions["B"].width = 40
-
-            sorted_results = sorted([result for result in self.results if 'best_time' in result], key=lambda x: x['best_time'])
-
-            for index, result in enumerate(sorted_results, start=1):
-                row_data = [index, result['driver'], f"{result['last_time']:.3f}", f"{result['best_time']:.3f}"]
-                row_index = ws.max_row + 1
-                ws.append(row_data)
-
-                for col_index, cell_value in enumerate(row_data, start=1):
-                    cell = ws.cell(row=row_index, column=col_index)
-                    cell.alignment = Alignment(horizontal="center")
-                    cell.border = Border(
-                        left=Side(border_style="thin"),
-                        right=Side(border_style="thin"),
-                        top=Side(border_style="thin"),
-                        bottom=Side(border_style="thin")
-                    )
-
-                    if index % 2 == 0:
-                        cell.fill = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
-
-            wb.save("leaderboard.xlsx")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to dump leaderboard to Excel: {str(e)}")
-            logging.error(f"Failed to dump leaderboard to Excel: {str(e)}")
+        # Coalesced and written by the exporter thread, never on the timing path
+        self.control.excel_exporter.request()
 
     def show_results(self):
         if self.results_window and self.results_window.winfo_exists():
@@ -480,29 +576,37 @@ class SlotCarManager(ctk.CTk):
         
         self.results_window = ctk.CTkToplevel(self.root)
         self.results_window.title("Race Results")
-        self.results_table2 = ttk.Treeview(self.results_window, columns=("Rank", "Driver", "Last Lap", "Best Lap"), show='headings', style="ResultsWindow.Treeview")
-        self.results_table2.heading("Rank", text="Pos")
-        self.results_table2.heading("Driver", text="Driver")
-        self.results_table2.heading("Last Lap", text="Last Lap (s)")
-        self.results_table2.heading("Best Lap", text="Best Lap (s)")
-        self.results_table2.column("Rank", anchor=tk.CENTER, width=50)
-        self.results_table2.column("Driver", anchor=tk.CENTER, width=200)
-        self.results_table2.column("Last Lap", anchor=tk.CENTER, width=300)
-        self.results_table2.column("Best Lap", anchor=tk.CENTER, width=150)
+        self.results_view_menu = ctk.CTkOptionMenu(self.results_window, values=list(self.RESULTS_VIEW_MODES), command=self.set_results_view_mode)
+        self.results_view_menu.set(next((label for label, mode in self.RESULTS_VIEW_MODES.items() if mode == self.results_view_mode), "Scroll"))
+        self.results_view_menu.pack(pady=(10, 0), padx=10, anchor=tk.E)
+        ttk.Style().configure("ResultsWindow.Treeview", rowheight=int(self.font_size_slider.get() * 1.5))
+        self.results_table2 = LeaderboardView(self.results_window, self.leaderboard, "ResultsWindow.Treeview",
+                                              {"Rank": 50, "Driver": 200, "Last Lap": 300, "Best Lap": 150},
+                                              mode=self.results_view_mode)
         self.results_table2.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
-        self.update_results_table()
+        self.results_table2.tree.bind("<Double-1>", self.show_photo_finish)
         logging.info("Results window created")
 
+    def set_results_view_mode(self, label):
+        self.results_view_mode = self.RESULTS_VIEW_MODES[label]
+        self.results_table2.set_mode(self.results_view_mode)
+        self.save_settings()
+        logging.info(f"Results view mode set to {self.results_view_mode}")
+
+    def show_photo_finish(self, event):
+        driver = self.results_table2.driver_at(event.y)
+        if driver:
+            from photo_finish import PhotoFinishViewer
+            PhotoFinishViewer(self.results_window, driver)
+
     def update_font_size(self, size):
         if self.results_window:
             #width = self.results_window.winfo_width()
             #height = self.results_window.winfo_height()
             #font_size = max(10, int(min(width, height) * 0.03))
             custom_font = ("Arial", size, "bold")
-            style = ttk.Style()
-            style.configure("ResultsWindow.Treeview.Heading", font=custom_font)
-            style.configure("ResultsWindow.Treeview", font=custom_font)
-            self.update_results_table()
+            # Restyles the rows already on screen; the leaderboard itself is not redrawn
+            self.results_table2.set_font(custom_font, int(size * 1.5))
     
     def on_slider_change(self, value):
         if self.debounce_timer:
@@ -511,36 +615,66 @@ class SlotCarManager(ctk.CTk):
         self.debounce_timer = self.root.after(self.debounce_interval, self.update_font_size, int(float(value)))
 
     def export_results_to_excel(self):
-        workbook = Workbook()
-        sheet = workbook.active
-        sheet.title = "Race Results"
-        headers = ["Rank", "Driver", "Last Lap (s)", "Best Lap (s)"]
-        header_font = Font(bold=True)
-        header_alignment = Alignment(horizontal='center')
-        for col_num, header in enumerate(headers, 1):
-            cell = sheet.cell(row=1, column=col_num, value=header)
-            cell.font = header_font
-            cell.alignment = header_alignment
-        sorted_results = sorted(self.results, key=lambda x: x['best_time'])
-        for rank, result in enumerate(sorted_results, start=1):
-            driver = result['driver']
-            lap_times = ", ".join(f"{t:.2f}" for t in result['lap_times'])
-            best_time = result.get("last_time", "")
-            row = [rank, driver, lap_times, best_time]
-            for col_num, value in enumerate(row, 1):
-                cell = sheet.cell(radio_framectkrow=rank + 1, column=col_num, value=value)
-                cell.alignment = Alignment(horizontal='center')
-        file_path = "race_results.xlsx"
-        workbook.save(file_path)
-        messagebox.showinfo("Export Successful", f"Results exported to {file_path}")
-        logging.info(f"Results exported to {file_path}")
+        # The season report is written by a background job; the bar shows how far it has got
+        if self.season_report and self.season_report.is_alive():
+            messagebox.showinfo("Export Running", "The season report is still being written.")
+            return
+        stats = self.control.season_stats(wait=0)
+        if stats is None:
+            messagebox.showerror("Error", "The lap history is still loading, try again in a moment.")
+            logging.warning("Season report requested before the lap history loaded")
+            return
+        from season_report import SeasonReport
+        report_format = self.REPORT_FORMATS[self.report_format_menu.get()]
+        self.season_report = SeasonReport(self.control.history, stats, "season_report.xlsx", report_format)
+        self.season_report.start()
+        self.export_button.configure(state="disabled")
+        self.export_progress.set(0)
+        logging.info(f"Season report export started as {report_format}")
+        self.root.after(200, self.poll_season_report)
+
+    def poll_season_report(self):
+        report = self.season_report
+        self.export_progress.set(report.progress())
+        if report.is_alive():
+            self.root.after(200, self.poll_season_report)
+            return
+        self.export_button.configure(state="normal")
+        if report.error is not None:
+            messagebox.showerror("Error", f"Failed to export season report: {str(report.error)}")
+        else:
+            self.export_progress.set(1)
+            messagebox.showinfo("Export Successful", f"Season report exported to {', '.join(report.files)}")
+
+    def report_startup(self, filename, imports_done):
+        # Used by benchmark_startup.py: note when the first frame has drawn and
+        # when the background warm-up finished, write the times and quit
+        def first_paint():
+            self.root.update_idletasks()
+            painted = time.perf_counter()
+            wait_for_sounds(painted)
+
+        def wait_for_sounds(painted):
+            if not self.sound_bank.loaded.is_set():
+                self.root.after(10, wait_for_sounds, painted)
+                return
+            save_data(filename, {'imports_done': imports_done, 'first_paint': painted, 'warm': time.perf_counter()})
+            self.on_close()
+
+        self.root.after_idle(first_paint)
 
     def on_close(self):
-        pygame.mixer.quit()
+        if self.race_server is not None:
+            self.race_server.stop()
+        self.control.close()
         self.root.destroy()
         sys.exit()
 
 if __name__ == "__main__":
+    imports_done = time.perf_counter()
+    settings = load_data('settings.json', 0)
+    setup_logging_from_settings(settings, os.path.join('logs', 'project_slotcar.log'))
+    instrumentation.enable(settings.get('instrumentation', False))
     ctk.set_appearance_mode("System")
     ctk.set_default_color_theme("blue")
     root = ctk.CTk()
@@ -551,4 +685,6 @@ if __name__ == "__main__":
     style.configure("Custom.TreeviewLarge.Heading", font=("Helvetica", 24, "bold"))
     app = SlotCarManager(root)
     root.protocol("WM_DELETE_WINDOW", app.on_close)
+    if os.environ.get('SLOTCAR_STARTUP_BENCHMARK'):
+        app.report_startup(os.environ['SLOTCAR_STARTUP_BENCHMARK'], imports_done)
     root.mainloop()
@@ -0,0 +1,162 @@
+import os
+import json
+import queue
+import threading
+import time
+import logging
+import tkinter as tk
+from tkinter import PhotoImage
+import customtkinter as ctk
+
+import cv2
+import numpy as np
+
+PHOTO_FINISH_FOLDER = 'photo_finish'
+
+
+class FrameHistory:
+    # The last few seconds of frames, capped by memory rather than by count.
+    # Slots are allocated once as the history fills and then overwritten in turn.
+    def __init__(self, frame_shape, max_bytes=200 * 1024 * 1024):
+        frame_bytes = int(np.prod(frame_shape))
+        self.frame_shape = frame_shape
+        self.capacity = max(2, max_bytes // frame_bytes)
+        self.frames = []
+        self.timestamps = []
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, frame, timestamp):
+        # Capture thread listener
+        with self.lock:
+            if len(self.frames) < self.capacity:
+                self.frames.append(np.empty(self.frame_shape, dtype=np.uint8))
+                self.timestamps.append(0)
+            slot = self.next_slot
+            np.copyto(self.frames[slot], frame)
+            self.timestamps[slot] = timestamp
+            self.next_slot = (slot + 1) % self.capacity
+
+    @property
+    def newest_timestamp(self):
+        with self.lock:
+            return max(self.timestamps) if self.timestamps else None
+
+    def around(self, timestamp, window_ns, limit):
+        # Copies of the frames within window_ns of timestamp, closest first
+        with self.lock:
+            nearby = sorted((abs(stamp - timestamp), slot) for slot, stamp in enumerate(self.timestamps)
+                            if abs(stamp - timestamp) <= window_ns)
+            return [(self.timestamps[slot], self.frames[slot].copy()) for _, slot in nearby[:limit]]
+
+
+class PhotoFinish(threading.Thread):
+    # Turns lap events into saved frames. on_lap runs on the race thread and only
+    # queues the request; waiting for the frames after the trigger and PNG
+    # encoding both happen here.
+    def __init__(self, history, burst_window=0.05, burst_limit=5, folder=PHOTO_FINISH_FOLDER):
+        super().__init__(name="PhotoFinish", daemon=True)
+        self.history = history
+        self.burst_window_ns = int(burst_window * 1e9)
+        self.burst_limit = burst_limit
+        self.folder = folder
+        self.requests = queue.Queue(maxsize=64)
+        self.running = True
+
+    def on_lap(self, lap):
+        try:
+            self.requests.put_nowait(lap)
+        except queue.Full:
+            logging.warning(f"Photo finish queue full, skipped lap {lap.lap} of {lap.driver}")
+
+    def run(self):
+        while self.running:
+            try:
+                lap = self.requests.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.save(lap)
+            except Exception as e:
+                logging.error(f"Failed to save photo finish: {str(e)}")
+
+    def save(self, lap):
+        # Give the capture thread a moment to record the frames after the crossing
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline:
+            newest = self.history.newest_timestamp
+            if newest is not None and newest >= lap.timestamp + self.burst_window_ns:
+                break
+            time.sleep(0.01)
+        frames = self.history.around(lap.timestamp, self.burst_window_ns, self.burst_limit)
+        if not frames:
+            logging.warning(f"No frames near lap {lap.lap} of {lap.driver} for a photo finish")
+            return
+
+        folder = os.path.join(self.folder, lap.race_id)
+        os.makedirs(folder, exist_ok=True)
+        safe_driver = "".join(c if c.isalnum() or c in "-_" else "_" for c in lap.driver)
+        files = []
+        for index, (timestamp, frame) in enumerate(frames, start=1):
+            filename = os.path.join(folder, f"{safe_driver}_lap{lap.lap}_{index}.png")
+            cv2.imwrite(filename, frame)
+            files.append({'file': filename, 'offset_ms': (timestamp - lap.timestamp) / 1e6})
+        record = {'race': lap.race_id, 'lane': lap.lane, 'driver': lap.driver, 'lap': lap.lap,
+                  'time': lap.lap_time, 'frames': files}
+        with open(os.path.join(self.folder, 'index.jsonl'), 'a') as file:
+            file.write(json.dumps(record) + "\n")
+        logging.info(f"Saved {len(files)} photo finish frames for lap {lap.lap} of {lap.driver}")
+
+    def stop(self):
+        self.running = False
+
+
+def load_photo_finishes(driver, folder=PHOTO_FINISH_FOLDER):
+    records = []
+    try:
+        with open(os.path.join(folder, 'index.jsonl'), 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('driver') == driver:
+                    records.append(record)
+    except FileNotFoundError:
+        pass
+    return records
+
+
+class PhotoFinishViewer(ctk.CTkToplevel):
+    def __init__(self, master, driver, **kwargs):
+        super().__init__(master, **kwargs)
+        self.title(f"Photo Finish - {driver}")
+        self.records = load_photo_finishes(driver)
+        self.photo = None
+
+        if not self.records:
+            ctk.CTkLabel(self, text=f"No photo finishes recorded for {driver}.").pack(padx=20, pady=20)
+            return
+
+        self.choices = {}
+        for record in reversed(self.records):
+            for index, frame in enumerate(record['frames'], start=1):
+                label = f"Race {record['race']} lap {record['lap']} ({record['time']:.3f} s) frame {index}, {frame['offset_ms']:+.0f} ms"
+                self.choices[label] = frame['file']
+        self.menu = ctk.CTkOptionMenu(self, values=list(self.choices), command=self.show_frame)
+        self.menu.pack(padx=10, pady=10, fill=tk.X)
+        self.image_label = tk.Label(self)
+        self.image_label.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
+        first = next(iter(self.choices))
+        self.menu.set(first)
+        self.show_frame(first)
+
+    def show_frame(self, label):
+        try:
+            photo = PhotoImage(file=self.choices[label])
+            # Keep large camera frames on screen
+            factor = max(1, -(-photo.width() // 1280), -(-photo.height() // 720))
+            self.photo = photo.subsample(factor) if factor > 1 else photo
+            self.image_label.configure(image=self.photo)
+        except tk.TclError as e:
+            logging.error(f"Failed to show photo finish {self.choices[label]}: {str(e)}")
@@ -0,0 +1,229 @@
+import time
+import queue
+import logging
+from collections import namedtuple
+
+from serial_reader import Disqualify, PORT_CLOSED, CAMERA_TRIGGER, elapsed_seconds
+import instrumentation
+
+# One completed lap as seen by listeners; timestamp is the perf_counter_ns stamp of the trigger that ended it
+LapEvent = namedtuple('LapEvent', ['race_id', 'lane', 'driver', 'lap', 'lap_time', 'penalty', 'timestamp'])
+
+# Graded jump start penalties as (seconds before GO, penalty) pairs, checked in
+# order. A jump earlier than the last step gets the flat early start penalty.
+GRADED_START_PENALTIES = ((0.1, 0.5), (0.25, 1.0), (0.5, 1.5))
+
+
+def start_penalty(reaction, flat_penalty, steps=None):
+    if reaction >= 0:
+        return 0
+    for early, penalty in steps or ():
+        if -reaction <= early:
+            return penalty
+    return flat_penalty
+
+
+class LapCounter:
+    def __init__(self, laps, start, early_start=False, count_first=False, use_device_clock=False, early_start_penalty=0):
+        self.laps = laps
+        self.lap_start = start
+        self.early_start = early_start
+        # When False the first trigger is the car crossing the line after GO, not a finished lap
+        self.count_first = count_first
+        self.use_device_clock = use_device_clock
+        self.early_start_penalty = early_start_penalty
+        # The trigger that started this lane's race, so None until the car first crosses the line
+        self.first_trigger = start if early_start else None
+        self.lap_times = []
+        self.penalties = []
+
+    @property
+    def finished(self):
+        return len(self.lap_times) >= self.laps
+
+    def feed(self, event):
+        if not self.count_first:
+            self.count_first = True
+            self.first_trigger = event
+            return None
+        lap_time = elapsed_seconds(self.lap_start, event, self.use_device_clock)
+        self.lap_start = event
+        penalty = self.early_start_penalty if not self.lap_times and self.early_start else 0
+        lap_time += penalty
+        self.lap_times.append(lap_time)
+        self.penalties.append(penalty)
+        return lap_time
+
+
+class SensorCrossCheck:
+    # Flags camera triggers with no serial trigger in the same lane within the
+    # tolerance either side, which usually means the light gate missed a lap
+    def __init__(self, tolerance=0.15):
+        self.tolerance_ns = int(tolerance * 1e9)
+        self.last_serial = {}
+        self.pending = {}
+        self.missed = []
+
+    def observe(self, event):
+        lane = event.lane
+        if lane is None:
+            return
+        if event.line == CAMERA_TRIGGER:
+            last = self.last_serial.get(lane)
+            if last is None or event.timestamp - last > self.tolerance_ns:
+                self.pending.setdefault(lane, []).append(event.timestamp)
+        else:
+            self.last_serial[lane] = event.timestamp
+            self.pending[lane] = [timestamp for timestamp in self.pending.get(lane, [])
+                                  if abs(event.timestamp - timestamp) > self.tolerance_ns]
+        self.expire(event.timestamp)
+
+    def expire(self, now):
+        for lane, timestamps in self.pending.items():
+            while timestamps and now - timestamps[0] > self.tolerance_ns:
+                self.missed.append((lane, timestamps.pop(0)))
+                logging.warning(f"Camera saw a crossing in lane {lane} that the serial sensor missed")
+
+    def settle(self, events):
+        # Once the heat is over, serial triggers still on their way get one
+        # tolerance to match; every camera trigger left after that was missed
+        latest = [timestamps[-1] for timestamps in self.pending.values() if timestamps]
+        if not latest:
+            return
+        deadline = max(latest) + self.tolerance_ns
+        while True:
+            remaining = deadline - time.perf_counter_ns()
+            if remaining <= 0:
+                break
+            try:
+                event = events.get(timeout=remaining / 1e9)
+            except queue.Empty:
+                break
+            if hasattr(event, 'line'):
+                self.observe(event)
+        self.expire(deadline + 1)
+
+
+class Heat:
+    # Times every lane of one race from a single event stream. drivers maps lane
+    # number to driver name; lap_source picks whether 'serial' or 'camera'
+    # triggers count laps, and cross_check compares the two while racing.
+    # penalty_steps grades jump start penalties by how early they were; without
+    # them every jump start costs early_start_penalty.
+    def __init__(self, drivers, laps, use_device_clock=False, early_start_penalty=0, lap_source='serial', cross_check=False,
+                 penalty_steps=None):
+        self.drivers = dict(drivers)
+        self.laps = laps
+        self.race_id = time.strftime('%Y%m%d-%H%M%S')
+        self.use_device_clock = use_device_clock
+        self.early_start_penalty = early_start_penalty
+        self.lap_source = lap_source
+        self.cross_check = SensorCrossCheck() if cross_check else None
+        self.penalty_steps = penalty_steps
+        self.go_time = None
+        self.counters = {}
+        self.disqualified = set()
+
+    def counts(self, event):
+        return (event.line == CAMERA_TRIGGER) == (self.lap_source == 'camera')
+
+    def jump_start(self, event):
+        # A trigger before GO starts that lane's first lap early; returns True if it was one
+        lane = event.lane
+        if not self.counts(event) or lane not in self.drivers or lane in self.counters or lane in self.disqualified:
+            return False
+        self.start_early(event)
+        return True
+
+    def start_early(self, event):
+        # The penalty depends on how early the jump was, so it is set once GO is known
+        counter = LapCounter(self.laps, event, True, True, self.use_device_clock)
+        self.counters[event.lane] = counter
+        if self.go_time is not None:
+            counter.early_start_penalty = start_penalty(self.reaction_time(event.lane), self.early_start_penalty, self.penalty_steps)
+
+    @property
+    def all_started(self):
+        return all(lane in self.counters or lane in self.disqualified for lane in self.drivers)
+
+    def go(self, start):
+        self.go_time = start
+        for lane in self.drivers:
+            counter = self.counters.get(lane)
+            if counter is None:
+                self.counters[lane] = LapCounter(self.laps, start, False, False, self.use_device_clock)
+            else:
+                counter.early_start_penalty = start_penalty(self.reaction_time(lane), self.early_start_penalty, self.penalty_steps)
+
+    def reaction_time(self, lane):
+        # Seconds from GO to the lane's first trigger on the host clock, negative
+        # for a jump start; None until both are known
+        counter = self.counters.get(lane)
+        if self.go_time is None or counter is None or counter.first_trigger is None:
+            return None
+        return (counter.first_trigger.timestamp - self.go_time.timestamp) / 1e9
+
+    def disqualify(self, lane=None):
+        lanes = self.drivers if lane is None else [lane]
+        newly = [lane for lane in lanes if lane in self.drivers and lane not in self.disqualified and not self.lane_finished(lane)]
+        self.disqualified.update(newly)
+        return newly
+
+    def lane_finished(self, lane):
+        counter = self.counters.get(lane)
+        return counter is not None and counter.finished
+
+    @property
+    def finished(self):
+        return all(lane in self.disqualified or self.lane_finished(lane) for lane in self.drivers)
+
+    def lap_event(self, lane):
+        counter = self.counters[lane]
+        return LapEvent(self.race_id, lane, self.drivers[lane], len(counter.lap_times),
+                        counter.lap_times[-1], counter.penalties[-1], counter.lap_start.timestamp)
+
+    def feed(self, event):
+        if self.cross_check is not None:
+            self.cross_check.observe(event)
+        if not self.counts(event):
+            return None
+        lane = event.lane
+        if lane in self.disqualified or lane not in self.counters:
+            return None
+        counter = self.counters[lane]
+        if counter.finished:
+            return None
+        if counter.first_trigger is None and event.timestamp < self.go_time.timestamp:
+            # Stamped before GO but only read after it, so still a jump start
+            self.start_early(event)
+            return None
+        return counter.feed(event)
+
+
+def race_updates(events, heat):
+    # Yields (lane, lap_time) for each completed lap and (lane, None) for each
+    # disqualified lane, blocking on the queue until every lane is done. With a
+    # cross check the wait wakes up every tolerance, so a camera trigger the
+    # serial sensor missed is reported even when no other event follows it.
+    cross_check = heat.cross_check
+    timeout = cross_check.tolerance_ns / 1e9 if cross_check is not None else None
+    while not heat.finished:
+        try:
+            event = events.get(timeout=timeout)
+        except queue.Empty:
+            cross_check.expire(time.perf_counter_ns())
+            continue
+        if hasattr(event, 'timestamp'):
+            # How long the event waited between being stamped and reaching the race thread
+            instrumentation.record('race.dequeue', time.perf_counter_ns() - event.timestamp)
+        if isinstance(event, Disqualify):
+            for lane in heat.disqualify(event.lane):
+                yield lane, None
+            continue
+        if event is PORT_CLOSED:
+            raise IOError("Serial port was closed")
+        lap_time = heat.feed(event)
+        if lap_time is not None:
+            yield event.lane, lap_time
+    if cross_check is not None:
+        cross_check.settle(events)
@@ -0,0 +1,321 @@
+import queue
+import random
+import time
+import threading
+import logging
+
+from journal import LapJournal
+from leaderboard import Leaderboard
+from excel_export import LeaderboardExporter
+from serial_reader import SerialReader, Disqualify, PORT_CLOSED, start_marker, drain
+from race import Heat, race_updates, GRADED_START_PENALTIES
+from countdown import CountdownSchedule, CountdownStep
+from log_setup import log_event
+import instrumentation
+
+
+class RaceControl:
+    # Everything needed to run heats, with no UI: the lap sensors, countdown,
+    # timing, leaderboard, journal and Excel export. The Tk app and the race
+    # server both drive it. Listeners are called on the race thread as
+    # listener(kind, data) with a JSON ready dict and must return quickly;
+    # lap_listeners get the LapEvent itself.
+    def __init__(self, settings, sound_bank=None):
+        self.journal = LapJournal('laps.jsonl', 'results.json')
+        self.leaderboard = Leaderboard(self.journal.load())
+        # Every lap of the season for the stats engine, where the leaderboard
+        # only keeps last and best. Loaded by load_history_in_background.
+        # Journal writes and history updates happen together under the lock,
+        # so a snapshot or the end of a load sees the two agree.
+        self.history = None
+        self.stats = None
+        self.history_lock = threading.Lock()
+        self.history_loaded = threading.Event()
+        self.history_saver = None
+        self.excel_exporter = LeaderboardExporter(self.leaderboard, 'leaderboard.xlsx')
+        self.excel_exporter.start()
+        self.sound_bank = sound_bank
+
+        self.serial_port = settings.get('serial_port', 'COM3')
+        self.early_start_penalty = settings.get('early_start_penalty', 2)
+        self.timing_mode = settings.get('timing_mode', 'host')
+        self.lane_count = settings.get('lane_count', 4)
+        self.lap_sensor = settings.get('lap_sensor', 'serial')
+        self.penalty_mode = settings.get('penalty_mode', 'flat')
+        self.penalty_steps = [tuple(step) for step in settings.get('penalty_steps', GRADED_START_PENALTIES)]
+
+        # Every lap sensor and the disqualify buttons feed this one queue
+        self.race_events = queue.Queue()
+        self.serial_reader = None
+        self.race_thread = None
+        self.heat = None
+        self.listeners = []
+        self.lap_listeners = []
+
+    def settings(self):
+        return {
+            'serial_port': self.serial_port,
+            'early_start_penalty': self.early_start_penalty,
+            'timing_mode': self.timing_mode,
+            'lane_count': self.lane_count,
+            'lap_sensor': self.lap_sensor,
+            'penalty_mode': self.penalty_mode,
+            'penalty_steps': self.penalty_steps
+        }
+
+    def notify(self, kind, **data):
+        for listener in list(self.listeners):
+            try:
+                listener(kind, data)
+            except Exception as e:
+                logging.error(f"Race listener failed: {str(e)}")
+
+    @instrumentation.timed('play_sound')
+    def play_sound(self, name):
+        if self.sound_bank is None:
+            return
+        try:
+            self.sound_bank.play(name)
+        except Exception as e:
+            logging.error(f"Failed to play sound: {str(e)}")
+
+    def get_serial_reader(self):
+        reader = self.serial_reader
+        if reader is None or not reader.is_alive() or reader.port != self.serial_port:
+            if reader is not None:
+                reader.stop()
+            reader = SerialReader(self.serial_port, 9600, self.race_events)
+            reader.start()
+            self.serial_reader = reader
+        return reader
+
+    def close_serial_reader(self):
+        if self.serial_reader is not None:
+            self.serial_reader.stop()
+            self.serial_reader = None
+            # A heat waiting on the port would otherwise never hear from it again
+            if self.racing and self.heat is not None and self.heat.lap_source == 'serial':
+                self.race_events.put(PORT_CLOSED)
+
+    def set_serial_port(self, port):
+        # Raises RuntimeError while a heat is running
+        if self.racing:
+            raise RuntimeError("Cannot change the serial port during a race.")
+        self.serial_port = port
+        self.close_serial_reader()
+
+    @property
+    def racing(self):
+        return self.race_thread is not None and self.race_thread.is_alive()
+
+    def new_heat(self, lane_drivers, laps):
+        lap_source = 'camera' if self.lap_sensor == 'camera' else 'serial'
+        penalty_steps = self.penalty_steps if self.penalty_mode == 'graded' else None
+        return Heat(lane_drivers, laps, self.timing_mode == 'device', self.early_start_penalty,
+                    lap_source, self.lap_sensor == 'cross-check', penalty_steps)
+
+    def start_heat(self, lane_drivers, laps, seconds=5):
+        # Raises ValueError for a heat that cannot run and RuntimeError while another is running
+        if laps <= 0:
+            raise ValueError("Number of laps must be greater than zero.")
+        if seconds < 0:
+            raise ValueError("Countdown cannot be negative.")
+        if not lane_drivers:
+            raise ValueError("Assign a driver to at least one lane.")
+        if len(set(lane_drivers.values())) != len(lane_drivers):
+            raise ValueError("A driver can only race in one lane.")
+        if self.racing:
+            raise RuntimeError("A race is already running.")
+        heat = self.new_heat(lane_drivers, laps)
+        self.heat = heat
+        self.race_thread = threading.Thread(target=self.countdown, args=(seconds, heat), name="Race", daemon=True)
+        self.race_thread.start()
+        logging.info(f"Starting heat with lanes {lane_drivers}")
+        return heat
+
+    def disqualify(self, lane=None):
+        # Wakes run_race straight away; a stale marker is drained by the next countdown
+        self.race_events.put(Disqualify(lane))
+        logging.info("Driver disqualified" if lane is None else f"Lane {lane} disqualified")
+
+    def remove_driver(self, driver):
+        change = self.leaderboard.remove(driver)
+        with self.history_lock:
+            self.journal.append_removal(driver)
+            if self.history is not None:
+                self.history.remove_driver(driver)
+        if self.journal.maybe_compact(self.leaderboard.results):
+            self.save_history_in_background()
+        if change is not None:
+            self.notify_change(change)
+            self.excel_exporter.request()
+        return change
+
+    def load_history(self):
+        # NumPy is imported here rather than at startup
+        from lap_history import LapHistory
+        from season_stats import SeasonStats
+        try:
+            # The bulk of the journal is read while laps keep being recorded;
+            # only the few records written meanwhile are replayed under the lock
+            history = LapHistory.load('laps.jsonl', 'lap_history.npz')
+            with self.history_lock:
+                history.replay('laps.jsonl')
+                self.history = history
+                self.stats = SeasonStats(history)
+        except Exception as e:
+            logging.error(f"Failed to load lap history: {str(e)}")
+        finally:
+            self.history_loaded.set()
+
+    def load_history_in_background(self):
+        threading.Thread(target=self.load_history, name="LapHistoryLoader", daemon=True).start()
+
+    def save_history(self, state, journal_offset):
+        try:
+            self.history.write('lap_history.npz', state, journal_offset)
+        except OSError as e:
+            logging.error(f"Failed to save lap history: {str(e)}")
+
+    def save_history_in_background(self):
+        # Runs after a journal compaction, so a crash only loses the replay
+        # since then. The state is taken under the lock; writing it is not.
+        if self.history is None or (self.history_saver is not None and self.history_saver.is_alive()):
+            return
+        with self.history_lock:
+            state = self.history.state()
+            journal_offset = self.journal.offset()
+        self.history_saver = threading.Thread(target=self.save_history, args=(state, journal_offset),
+                                              name="LapHistorySaver", daemon=True)
+        self.history_saver.start()
+
+    def season_stats(self, wait=5.0):
+        # None if the history has not loaded within wait seconds
+        self.history_loaded.wait(wait)
+        return self.stats
+
+    def notify_change(self, change):
+        result = self.leaderboard.get(change.driver) or {}
+        self.notify('leaderboard', driver=change.driver, old_rank=change.old_rank, new_rank=change.new_rank,
+                    last_time=result.get('last_time'), best_time=result.get('best_time'))
+
+    def heat_state(self):
+        heat = self.heat
+        if heat is None:
+            return None
+        lanes = []
+        for lane, driver in sorted(heat.drivers.items()):
+            counter = heat.counters.get(lane)
+            lanes.append({'lane': lane, 'driver': driver, 'laps': list(counter.lap_times) if counter else [],
+                          'disqualified': lane in heat.disqualified, 'reaction': heat.reaction_time(lane)})
+        return {'race': heat.race_id, 'laps': heat.laps, 'running': self.racing, 'lanes': lanes}
+
+    def countdown(self, seconds, heat):
+        try:
+            if heat.lap_source == 'serial':
+                self.get_serial_reader()
+            events = self.race_events
+            drain(events)
+            self.notify('heat', race=heat.race_id, laps=heat.laps, drivers={str(lane): driver for lane, driver in heat.drivers.items()})
+            schedule = CountdownSchedule(seconds)
+            for event in schedule.run(events):
+                if isinstance(event, CountdownStep):
+                    if event.number == 0:
+                        break
+                    self.notify('countdown', number=event.number)
+                    self.play_sound(f"countdown/{event.number}")
+                elif isinstance(event, Disqualify):
+                    for lane in heat.disqualify(event.lane):
+                        logging.info(f"Lane {lane} ({heat.drivers[lane]}) disqualified during countdown")
+                        self.notify('disqualified', race=heat.race_id, lane=lane, driver=heat.drivers[lane])
+                    if heat.finished:
+                        self.notify('finished', race=heat.race_id, disqualified=True, reactions={}, missed=[])
+                        return
+                elif event is PORT_CLOSED:
+                    raise IOError(f"Serial port {self.serial_port} was closed")
+                elif heat.jump_start(event):
+                    self.notify('early_start', race=heat.race_id, lane=event.lane, driver=heat.drivers[event.lane])
+                    self.play_sound(f"false_start/{random.randint(1, 3)}")
+                    logging.info(f"Early start in lane {event.lane}, {(schedule.go_deadline - event.timestamp) / 1e9:.3f} s before GO")
+                    if heat.all_started:
+                        # Nobody is left waiting for GO; jumps are graded against when it was due
+                        heat.go(start_marker(schedule.go_deadline))
+                        log_event('go', race=heat.race_id, timestamp=schedule.go_deadline, drivers=heat.drivers)
+                        self.notify('go', race=heat.race_id)
+                        self.run_race(events, heat)
+                        return
+            # Stamped as GO is released, before the sound and overlay are drawn
+            heat.go(start_marker(event.fired))
+            log_event('go', race=heat.race_id, timestamp=event.fired, drivers=heat.drivers)
+            logging.debug(f"GO released {(event.fired - event.deadline) / 1e6:.3f} ms after its deadline")
+            self.play_sound("countdown/GO")
+            self.notify('go', race=heat.race_id)
+            self.run_race(events, heat)
+        except Exception as e:
+            logging.error(f"Serial communication error: {str(e)}")
+            self.notify('error', message=f"Serial communication error: {str(e)}")
+
+    def run_race(self, events, heat):
+        try:
+            logging.info(f"Started race with lanes {heat.drivers}")
+
+            # Kept at full precision; only the displays round
+            for lane, lap_time in race_updates(events, heat):
+                driver = heat.drivers[lane]
+                if lap_time is None:
+                    self.play_sound(f"disqualified/{random.randint(1, 3)}")
+                    logging.info(f"Lane {lane} ({driver}) disqualified")
+                    self.notify('disqualified', race=heat.race_id, lane=lane, driver=driver)
+                    continue
+                change = self.leaderboard.record_lap(driver, lap_time)
+                logging.debug(f"{driver} moved from rank {change.old_rank} to {change.new_rank}")
+                lap = heat.lap_event(lane)
+                reaction = heat.reaction_time(lane) if lap.lap == 1 else None
+                if reaction is not None:
+                    logging.info(f"Reaction time of {driver}: {reaction:+.3f} s, penalty {lap.penalty} s")
+                with self.history_lock:
+                    self.journal.append_lap(lap.race_id, lane, driver, lap.lap, lap_time, lap.penalty, reaction)
+                    if self.history is not None:
+                        self.history.append(lap.race_id, driver, lap.lap, lap_time, lap.penalty, reaction, time.time())
+                log_event('lap', race=lap.race_id, lane=lane, driver=driver, lap=lap.lap, time=lap_time,
+                          penalty=lap.penalty, reaction=reaction, timestamp=lap.timestamp)
+                if self.journal.maybe_compact(self.leaderboard.results):
+                    self.save_history_in_background()
+                for listener in list(self.lap_listeners):
+                    try:
+                        listener(lap)
+                    except Exception as e:
+                        logging.error(f"Lap listener failed: {str(e)}")
+                self.notify('lap', race=lap.race_id, lane=lane, driver=driver, lap=lap.lap, time=lap_time,
+                            penalty=lap.penalty, reaction=reaction)
+                self.notify_change(change)
+                self.excel_exporter.request()
+                # Sensor pulse to leaderboard, journal and listeners all updated
+                instrumentation.record('lap.latency', time.perf_counter_ns() - lap.timestamp)
+                instrumentation.count('laps')
+                if heat.lane_finished(lane):
+                    logging.info(f"Lane {lane} ({driver}) finished")
+
+            reactions = {heat.drivers[lane]: heat.reaction_time(lane) for lane in sorted(heat.drivers)
+                         if heat.reaction_time(lane) is not None}
+            missed = [{'lane': lane, 'timestamp': timestamp} for lane, timestamp in heat.cross_check.missed] if heat.cross_check else []
+            self.notify('finished', race=heat.race_id, disqualified=len(heat.disqualified) == len(heat.drivers),
+                        reactions=reactions, missed=missed)
+            if len(heat.disqualified) < len(heat.drivers):
+                self.play_sound(f"well_done/{random.randint(1, 3)}")
+            logging.info("Finished race...")
+        except Exception as e:
+            logging.error(f"Failed to run race: {str(e)}")
+            self.notify('error', message=f"Failed to run race: {str(e)}")
+
+    def close(self):
+        self.close_serial_reader()
+        self.journal.close(self.leaderboard.results())
+        if self.history_saver is not None:
+            self.history_saver.join()
+        with self.history_lock:
+            if self.history is not None:
+                self.save_history(self.history.state(), self.journal.offset())
+        self.excel_exporter.stop()
+        if self.sound_bank is not None:
+            self.sound_bank.close()
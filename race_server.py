@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import logging
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+
+from data_manager import load_data
+from race_control import RaceControl
+from log_setup import setup_logging_from_settings
+import instrumentation
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_REQUEST_BYTES = 64 * 1024
+# A display that stops reading is dropped once this much is waiting for it
+MAX_CLIENT_BACKLOG = 1024 * 1024
+
+
+def websocket_frame(payload, opcode=0x1):
+    # One unmasked, unfragmented frame as a server sends it
+    header = bytearray([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header.append(length)
+    elif length < 65536:
+        header.append(126)
+        header += length.to_bytes(2, 'big')
+    else:
+        header.append(127)
+        header += length.to_bytes(8, 'big')
+    return bytes(header) + payload
+
+
+class RaceServer:
+    # Local HTTP and WebSocket access to a RaceControl for spectator screens
+    # and commentator tablets:
+    #   GET  /results     the leaderboard in rank order
+    #   GET  /heat        the current or last heat
+    #   GET  /stats       season stats per driver, ?by=mean&start=0&limit=50
+    #   GET  /metrics     instrumentation spans and counters
+    #   POST /start       {"lanes": {"1": "Alice", "2": "Bob"}, "laps": 10, "countdown": 5}
+    #   POST /disqualify  {"lane": 2}, or {} for every lane still racing
+    #   GET  /events      WebSocket: a snapshot, then every race event as JSON
+    # Only this machine can connect unless host is set to a LAN address.
+    # Pages from other origins may read the GET endpoints, but POSTs must be
+    # application/json, which a browser cannot send cross-origin without a
+    # preflight that is refused. With a token set, every POST also needs
+    # "Authorization: Bearer <token>".
+    # A race event is encoded and framed once on the race thread and the same
+    # bytes are queued to every client, so each extra display costs one write.
+    def __init__(self, control, host='127.0.0.1', port=8765, token=None):
+        self.control = control
+        self.host = host
+        self.port = port
+        self.token = token
+        self.loop = None
+        self.stopped = None
+        self.error = None
+        self.clients = set()
+        self.connections = set()
+        self.thread = None
+        self.ready = threading.Event()
+        control.listeners.append(self.publish)
+
+    def start(self):
+        # Serves from a background thread, next to the GUI
+        self.thread = threading.Thread(target=self.run, name="RaceServer", daemon=True)
+        self.thread.start()
+        self.ready.wait(5)
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self.handle, self.host, self.port, limit=MAX_REQUEST_BYTES)
+        except OSError as e:
+            self.error = e
+            self.ready.set()
+            return
+        self.ready.set()
+        logging.info(f"Race server listening on {self.host}:{self.port}")
+        if self.host not in ('127.0.0.1', 'localhost', '::1') and not self.token:
+            logging.warning("Race server is reachable from the network without a token; anyone there can start races")
+        async with server:
+            await self.stopped.wait()
+        # Closing the displays ends their streams, so every connection finishes before the loop does
+        for writer in list(self.clients):
+            writer.close()
+        if self.connections:
+            await asyncio.wait(self.connections, timeout=2)
+        logging.info("Race server stopped")
+
+    def stop(self):
+        if self.publish in self.control.listeners:
+            self.control.listeners.remove(self.publish)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+        if self.thread is not None:
+            self.thread.join(5)
+
+    def publish(self, kind, data):
+        # Race thread listener: serialise once, then hand the bytes to the event loop
+        if self.loop is None or not self.clients:
+            return
+        frame = websocket_frame(json.dumps(dict(data, type=kind)).encode())
+        self.loop.call_soon_threadsafe(self.broadcast, frame)
+
+    def broadcast(self, frame):
+        for writer in list(self.clients):
+            if writer.transport.get_write_buffer_size() > MAX_CLIENT_BACKLOG:
+                logging.warning(f"Dropped race display {writer.get_extra_info('peername')}, it stopped reading")
+                self.clients.discard(writer)
+                writer.close()
+                continue
+            writer.write(frame)
+
+    def results(self):
+        return [dict(result, rank=rank) for rank, result in enumerate(self.control.leaderboard.ranked(), start=1)]
+
+    async def handle(self, reader, writer):
+        connection = asyncio.current_task()
+        self.connections.add(connection)
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+            lines = request.decode('latin-1').split('\r\n')
+            method, target, _ = lines[0].split(' ', 2)
+            headers = {}
+            for line in lines[1:]:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+            url = urlsplit(target)
+            path = url.path
+            if path == '/events' and headers.get('upgrade', '').lower() == 'websocket':
+                await self.stream_events(reader, writer, headers)
+                return
+            length = int(headers.get('content-length') or 0)
+            if length > MAX_REQUEST_BYTES:
+                await self.respond(writer, 413, {'error': "Request body too large"})
+                return
+            body = await reader.readexactly(length) if length else b''
+            if method == 'POST' and not self.authorised(headers):
+                await self.respond(writer, 401, {'error': "Missing or wrong race server token"})
+                return
+            if method == 'POST' and headers.get('content-type', '').split(';')[0].strip().lower() != 'application/json':
+                await self.respond(writer, 415, {'error': "POST bodies must be application/json"})
+                return
+            if method == 'GET' and path == '/stats':
+                status, payload = await self.season_stats(parse_qs(url.query))
+            else:
+                status, payload = self.route(method, path, body)
+            await self.respond(writer, status, payload, cors=method == 'GET')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+        except ValueError:
+            await self.respond(writer, 400, {'error': "Malformed request"})
+        finally:
+            self.connections.discard(connection)
+
+    def authorised(self, headers):
+        if not self.token:
+            return True
+        return hmac.compare_digest(headers.get('authorization', ''), f"Bearer {self.token}")
+
+    async def season_stats(self, query):
+        # Ranking a season is real work, so it runs on a worker thread
+        # rather than holding up the other clients on the event loop
+        stats = self.control.season_stats(wait=0)
+        if stats is None:
+            return 503, {'error': "Lap history is still loading"}
+        try:
+            start = int(query.get('start', ['0'])[0])
+            limit = query.get('limit', [None])[0]
+            stop = None if limit is None else start + int(limit)
+            ranked = await self.loop.run_in_executor(None, stats.ranked, query.get('by', ['best'])[0], start, stop)
+        except ValueError as e:
+            return 400, {'error': f"Bad request: {str(e)}"}
+        return 200, ranked
+
+    def route(self, method, path, body):
+        if method == 'OPTIONS':
+            # Preflights only succeed for reads; cross-origin pages cannot drive the race
+            return 204, None
+        try:
+            if method == 'GET' and path == '/results':
+                return 200, self.results()
+            if method == 'GET' and path == '/heat':
+                return 200, self.control.heat_state()
+            if method == 'GET' and path == '/metrics':
+                return 200, instrumentation.snapshot()
+            if method == 'POST' and path == '/start':
+                request = json.loads(body or b'{}')
+                lanes = {int(lane): str(driver) for lane, driver in request['lanes'].items()}
+                heat = self.control.start_heat(lanes, int(request['laps']), int(request.get('countdown', 5)))
+                return 202, {'race': heat.race_id}
+            if method == 'POST' and path == '/disqualify':
+                request = json.loads(body or b'{}')
+                lane = request.get('lane')
+                self.control.disqualify(None if lane is None else int(lane))
+                return 202, {}
+        except RuntimeError as e:
+            return 409, {'error': str(e)}
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return 400, {'error': f"Bad request: {str(e)}"}
+        return 404, {'error': f"No route for {method} {path}"}
+
+    async def respond(self, writer, status, payload, cors=False):
+        body = b'' if payload is None and status == 204 else json.dumps(payload).encode()
+        head = (f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n")
+        if cors or status == 204:
+            # Display pages served from elsewhere may read results, but never POST
+            head += ("Access-Control-Allow-Origin: *\r\n"
+                     "Access-Control-Allow-Methods: GET\r\n")
+        head += "Connection: close\r\n\r\n"
+        writer.write(head.encode('latin-1') + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def stream_events(self, reader, writer, headers):
+        key = headers.get('sec-websocket-key')
+        if not key:
+            await self.respond(writer, 400, {'error': "Missing Sec-WebSocket-Key"})
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode('latin-1'))
+        # A display that joins mid race starts from the current state
+        snapshot = {'type': 'snapshot', 'results': self.results(), 'heat': self.control.heat_state()}
+        writer.write(websocket_frame(json.dumps(snapshot).encode()))
+        self.clients.add(writer)
+        logging.info(f"Race display connected from {writer.get_extra_info('peername')}, {len(self.clients)} connected")
+        try:
+            await self.read_frames(reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def read_frames(self, reader, writer):
+        # Displays only listen: pings are answered, a close ends the stream and
+        # anything else is ignored
+        while True:
+            header = await reader.readexactly(2)
+            opcode = header[0] & 0x0F
+            length = header[1] & 0x7F
+            if length == 126:
+                length = int.from_bytes(await reader.readexactly(2), 'big')
+            elif length == 127:
+                length = int.from_bytes(await reader.readexactly(8), 'big')
+            if length > MAX_REQUEST_BYTES:
+                return
+            mask = await reader.readexactly(4) if header[1] & 0x80 else None
+            payload = await reader.readexactly(length)
+            if mask:
+                payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+            if opcode == 0x8:
+                writer.write(websocket_frame(payload[:2], 0x8))
+                return
+            if opcode == 0x9:
+                writer.write(websocket_frame(payload, 0xA))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Race control server for spectator displays, without the GUI")
+    settings = load_data('settings.json', 0)
+    parser.add_argument('--host', default=settings.get('race_server_host', '127.0.0.1'),
+                        help="address to listen on; 0.0.0.0 serves displays on the LAN")
+    parser.add_argument('--port', type=int, default=settings.get('race_server_port') or 8765)
+    parser.add_argument('--no-sound', action='store_true', help="run silently, for a host without speakers")
+    args = parser.parse_args()
+
+    setup_logging_from_settings(settings, os.path.join('logs', 'race_server.log'))
+    instrumentation.enable(settings.get('instrumentation', False))
+    sound_bank = None
+    if not args.no_sound:
+        from sound_bank import SoundBank
+        sound_bank = SoundBank(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sounds'))
+        sound_bank.load_in_background()
+    control = RaceControl(settings, sound_bank)
+    control.load_history_in_background()
+    server = RaceServer(control, args.host, args.port, settings.get('race_server_token'))
+    print(f"Race server on http://{args.host}:{args.port}, Ctrl+C to stop")
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        control.close()
+    if server.error is not None:
+        print(f"Failed to start race server: {str(server.error)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
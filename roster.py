@@ -0,0 +1,58 @@
+import bisect
+
+
+class Roster:
+    # Registered drivers. A dict keeps the registration order that drivers.json
+    # is saved in and answers membership and removal in constant time; a list
+    # of (casefolded name, name) pairs kept sorted with bisect gives the
+    # alphabetical order the driver list shows and is what search filters.
+    def __init__(self, names=()):
+        self.entries = dict.fromkeys(names)
+        self.keys = sorted((name.casefold(), name) for name in self.entries)
+        self.last_query = None
+        self.last_matches = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def names(self):
+        # Registration order, as saved to drivers.json
+        return list(self.entries)
+
+    def add(self, name):
+        if name in self.entries:
+            return False
+        self.entries[name] = None
+        bisect.insort(self.keys, (name.casefold(), name))
+        self.last_query = None
+        return True
+
+    def remove(self, name):
+        if name not in self.entries:
+            return False
+        del self.entries[name]
+        del self.keys[bisect.bisect_left(self.keys, (name.casefold(), name))]
+        self.last_query = None
+        return True
+
+    def search(self, query=''):
+        # Case-insensitive substring match in alphabetical order. Typing one
+        # more letter can only narrow the result, so while the query keeps
+        # containing the previous one only the previous matches are checked.
+        query = query.strip().casefold()
+        if not query:
+            return [name for _, name in self.keys]
+        if self.last_query is not None and self.last_query in query:
+            candidates = self.last_matches
+        else:
+            candidates = self.keys
+        matches = [entry for entry in candidates if query in entry[0]]
+        self.last_query = query
+        self.last_matches = matches
+        return [name for _, name in matches]
@@ -0,0 +1,159 @@
+import csv
+import os
+import datetime
+import threading
+import logging
+
+import numpy as np
+
+from excel_export import add_leaderboard_styles, styled_row
+from instrumentation import timed
+
+REPORT_FORMATS = ('xlsx', 'csv')
+LAP_HEADERS = ["Driver", "Race", "Lap", "Lap Time (s)", "Penalty (s)", "Reaction (s)", "Recorded"]
+RACE_HEADERS = ["Race", "Drivers", "Laps", "Best Lap (s)", "Best Driver", "Mean Lap (s)"]
+# Rows are pulled from the history and written this many at a time
+CHUNK_ROWS = 10000
+# Excel's limit per sheet; longer sheets carry on in "Laps 2" and so on
+EXCEL_MAX_ROWS = 1048576
+
+
+def season_headers(top_k):
+    return ["Rank", "Driver", "Laps", "Best Lap (s)", "Mean (s)", "Median (s)", "Std Dev (s)",
+            "Consistency (%)", f"Top {top_k} Average (s)", "Trend (s/lap)"]
+
+
+def leaderboard_chunks(ranked):
+    for start in range(0, len(ranked), CHUNK_ROWS):
+        yield [[rank, row['driver'], row['laps'], round(row['best'], 3), round(row['mean'], 3), round(row['median'], 3),
+                round(row['std'], 3), round(row['consistency'], 1), round(row['top_k'], 3), round(row['trend'], 4)]
+               for rank, row in enumerate(ranked[start:start + CHUNK_ROWS], start=start + 1)]
+
+
+def lap_chunks(columns, rows, names, races):
+    # rows is already in report order; only CHUNK_ROWS of them become Python objects at once
+    for start in range(0, len(rows), CHUNK_ROWS):
+        chunk = rows[start:start + CHUNK_ROWS]
+        yield [[names[driver], races[race], lap, round(lap_time, 3), penalty, None if reaction != reaction else round(reaction, 3),
+                datetime.datetime.fromtimestamp(timestamp) if timestamp else None]
+               for driver, race, lap, lap_time, penalty, reaction, timestamp
+               in zip(columns['driver'][chunk].tolist(), columns['race'][chunk].tolist(), columns['lap'][chunk].tolist(),
+                      columns['time'][chunk].tolist(), columns['penalty'][chunk].tolist(),
+                      columns['reaction'][chunk].tolist(), columns['timestamp'][chunk].tolist())]
+
+
+def race_summary(columns, rows, names, races):
+    # One row per race in the order they were run, from a single sort of the laps
+    if len(rows) == 0:
+        return []
+    race, lap_time, driver = columns['race'][rows], columns['time'][rows], columns['driver'][rows]
+    order = np.lexsort((lap_time, race))
+    ids, starts, counts = np.unique(race[order], return_index=True, return_counts=True)
+    best = lap_time[order][starts]
+    best_driver = driver[order][starts]
+    mean = np.add.reduceat(lap_time[order], starts) / counts
+    pairs = np.unique(race.astype(np.int64) * len(names) + driver)
+    drivers = np.bincount(pairs // len(names), minlength=len(races))[ids]
+    return [[races[race_id], driver_count, count, round(best_time, 3), names[best_id], round(mean_time, 3)]
+            for race_id, driver_count, count, best_time, best_id, mean_time
+            in zip(ids.tolist(), drivers.tolist(), counts.tolist(), best.tolist(), best_driver.tolist(), mean.tolist())]
+
+
+class SeasonReport(threading.Thread):
+    # Writes the whole season off the Tk thread: a leaderboard of season stats,
+    # every lap grouped by driver and a summary per race, as one workbook in
+    # openpyxl's write-only mode or as three CSV files. Rows stream from the
+    # lap history in chunks, so memory does not grow with the number of laps.
+    # done and total count rows for a progress bar; error is set on failure.
+    def __init__(self, history, stats, filename='season_report.xlsx', format='xlsx'):
+        super().__init__(name="SeasonReport", daemon=True)
+        if format not in REPORT_FORMATS:
+            raise ValueError(f"Unknown report format: {format}")
+        self.history = history
+        self.stats = stats
+        self.filename = filename
+        self.format = format
+        self.done = 0
+        self.total = 0
+        self.error = None
+        self.files = []
+
+    def progress(self):
+        return self.done / self.total if self.total else 0.0
+
+    def sheets(self):
+        columns, alive, names = self.history.view()
+        races = self.history.races[:]
+        ranked = self.stats.ranked('best')
+        # Laps of removed drivers are left out, and each driver's laps stay in the order they were run
+        rows = np.flatnonzero(alive[columns['driver']]) if len(names) else np.empty(0, dtype=np.int64)
+        alphabetical = np.empty(len(names), dtype=np.int64)
+        alphabetical[sorted(range(len(names)), key=lambda driver_id: names[driver_id].casefold())] = np.arange(len(names))
+        rows = rows[np.argsort(alphabetical[columns['driver'][rows]], kind='stable')]
+        summary = race_summary(columns, rows, names, races)
+        self.total = len(ranked) + len(rows) + len(summary)
+        return [("Leaderboard", season_headers(self.stats.top_k), leaderboard_chunks(ranked)),
+                ("Laps", LAP_HEADERS, lap_chunks(columns, rows, names, races)),
+                ("Races", RACE_HEADERS, iter([summary]))]
+
+    def run(self):
+        try:
+            if self.format == 'csv':
+                self.write_csv()
+            else:
+                self.write_xlsx()
+            logging.info(f"Season report of {self.total} rows written to {', '.join(self.files)}")
+        except Exception as e:
+            self.error = e
+            logging.error(f"Failed to write season report: {str(e)}")
+
+    @timed('season_report.xlsx')
+    def write_xlsx(self):
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        add_leaderboard_styles(workbook)
+        for name, headers, chunks in self.sheets():
+            part = 1
+            worksheet = self.add_sheet(workbook, name, headers)
+            written = 1
+            for chunk in chunks:
+                for row in chunk:
+                    if written == EXCEL_MAX_ROWS:
+                        part += 1
+                        worksheet = self.add_sheet(workbook, f"{name} {part}", headers)
+                        written = 1
+                    worksheet.append(row)
+                    written += 1
+                self.done += len(chunk)
+
+        temp_filename = f"{self.filename}.tmp"
+        workbook.save(temp_filename)
+        os.replace(temp_filename, self.filename)
+        self.files = [self.filename]
+
+    def add_sheet(self, workbook, name, headers):
+        worksheet = workbook.create_sheet(name)
+        for index, header in enumerate(headers):
+            worksheet.column_dimensions[chr(ord("A") + index)].width = max(12, len(header) + 4)
+        worksheet.freeze_panes = "A2"
+        worksheet.append(styled_row(worksheet, headers, "leaderboard_header"))
+        return worksheet
+
+    @timed('season_report.csv')
+    def write_csv(self):
+        # CSV has no sheets, so each one becomes season_report_<sheet>.csv
+        base = os.path.splitext(self.filename)[0]
+        files = []
+        for name, headers, chunks in self.sheets():
+            filename = f"{base}_{name.lower()}.csv"
+            temp_filename = f"{filename}.tmp"
+            with open(temp_filename, 'w', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerow(headers)
+                for chunk in chunks:
+                    writer.writerows(chunk)
+                    self.done += len(chunk)
+            os.replace(temp_filename, filename)
+            files.append(filename)
+        self.files = files
@@ -0,0 +1,107 @@
+import threading
+
+import numpy as np
+
+STATS = ('laps', 'best', 'mean', 'median', 'std', 'consistency', 'top_k', 'trend')
+# Every other stat ranks the smallest first; a negative trend means getting faster
+HIGHER_IS_BETTER = ('laps', 'consistency')
+
+
+def group_stats(drivers, times, top_k=5, trend_window=50):
+    # Stats for every driver in drivers, times in the order the laps were run.
+    # Returns the sorted unique driver ids and one array per stat aligned with them.
+    if len(times) == 0:
+        return np.empty(0, dtype=np.int32), {stat: np.empty(0) for stat in STATS}
+    # Stable, so each driver's laps stay in the order they were run
+    by_driver = np.argsort(drivers, kind='stable')
+    run = times[by_driver]
+    ids, starts, counts = np.unique(drivers[by_driver], return_index=True, return_counts=True)
+    mean = np.add.reduceat(run, starts) / counts
+    deviation = run - np.repeat(mean, counts)
+    std = np.sqrt(np.add.reduceat(deviation * deviation, starts) / counts)
+
+    # Fastest first within each driver, for best, median and the top-k average
+    fastest = run[np.lexsort((run, np.repeat(np.arange(len(ids)), counts)))]
+    median = (fastest[starts + (counts - 1) // 2] + fastest[starts + counts // 2]) / 2
+    cumulative = np.concatenate(([0.0], np.cumsum(fastest)))
+    k = np.minimum(counts, top_k)
+    top = (cumulative[starts + k] - cumulative[starts]) / k
+
+    # Least squares slope of lap time against lap number over each driver's
+    # last trend_window laps, in seconds per lap
+    position = np.arange(len(run)) - np.repeat(starts, counts)
+    window = np.minimum(counts, trend_window) if trend_window else counts
+    skipped = np.repeat(counts - window, counts)
+    recent = position >= skipped
+    window_starts = np.cumsum(window) - window
+    x = (position - skipped)[recent] - np.repeat((window - 1) / 2, window)
+    y = run[recent] - np.repeat(np.add.reduceat(run[recent], window_starts) / window, window)
+    spread = window * (window * window - 1) / 12
+    with np.errstate(invalid='ignore', divide='ignore'):
+        trend = np.where(window > 1, np.add.reduceat(x * y, window_starts) / spread, 0.0)
+        consistency = np.where(mean > 0, 100 * np.clip(1 - std / mean, 0, 1), 0.0)
+
+    return ids, {'laps': counts.astype(np.float64), 'best': fastest[starts], 'mean': mean, 'median': median,
+                 'std': std, 'consistency': consistency, 'top_k': top, 'trend': trend}
+
+
+class SeasonStats:
+    # Per driver lap statistics over a LapHistory, computed in whole column
+    # passes and cached by driver id. A new lap only invalidates its driver:
+    # the next read recomputes just the drivers that changed, from their rows
+    # alone, unless more than full_pass_fraction of the drivers changed and one
+    # pass over the season is cheaper.
+    def __init__(self, history, top_k=5, trend_window=50, full_pass_fraction=0.25):
+        self.history = history
+        self.top_k = top_k
+        self.trend_window = trend_window
+        self.full_pass_fraction = full_pass_fraction
+        self.lock = threading.Lock()
+        self.table = {stat: np.zeros(0) for stat in STATS}
+        self.alive = np.zeros(0, dtype=bool)
+        self.names = []
+
+    def refresh(self):
+        with self.lock:
+            changed = self.history.take_changed()
+            columns, self.alive, self.names = self.history.view()
+            size = len(self.names)
+            if size > len(self.table['laps']):
+                for stat, values in self.table.items():
+                    grown = np.zeros(max(size, 2 * len(values)))
+                    grown[:len(values)] = values
+                    self.table[stat] = grown
+            if not changed:
+                return
+            drivers, times = columns['driver'], columns['time']
+            if len(changed) <= self.full_pass_fraction * size:
+                rows = np.isin(drivers, np.fromiter(changed, dtype=np.int32, count=len(changed)))
+                drivers, times = drivers[rows], times[rows]
+            ids, values = group_stats(drivers, times, self.top_k, self.trend_window)
+            for stat in STATS:
+                self.table[stat][ids] = values[stat]
+
+    def row(self, driver_id):
+        stats = {stat: float(self.table[stat][driver_id]) for stat in STATS}
+        stats['laps'] = int(stats['laps'])
+        return dict(stats, driver=self.names[driver_id])
+
+    def ranked(self, by='best', start=0, stop=None):
+        # Drivers with at least one lap, best first by the given stat
+        if by not in STATS:
+            raise ValueError(f"Unknown stat: {by}")
+        self.refresh()
+        with self.lock:
+            size = len(self.names)
+            ids = np.flatnonzero(self.alive[:size] & (self.table['laps'][:size] > 0))
+            values = self.table[by][ids]
+            order = np.argsort(-values if by in HIGHER_IS_BETTER else values, kind='stable')
+            return [self.row(driver_id) for driver_id in ids[order][start:stop]]
+
+    def driver(self, name):
+        self.refresh()
+        with self.lock:
+            driver_id = self.history.driver_ids.get(name)
+            if driver_id is None or driver_id >= len(self.names) or not self.table['laps'][driver_id]:
+                return None
+            return self.row(driver_id)
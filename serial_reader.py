@@ -0,0 +1,123 @@
+import threading
+import queue
+import time
+import logging
+from collections import namedtuple
+
+from log_setup import log_event
+import instrumentation
+
+# One line received from the timing port. timestamp is time.perf_counter_ns()
+# taken when its first byte arrived; device_us is the microcontroller's own
+# microsecond counter when the line was sent as "1,<micros>", otherwise None.
+# lane is the lane that triggered: "L<n>" tags lane n and the original
+# single lane "1" counts as lane 1. Lines that are not triggers have no lane.
+SerialEvent = namedtuple('SerialEvent', ['timestamp', 'line', 'device_us', 'lane'])
+
+# Other lap sensors publish SerialEvents on the same queue with their own line value
+CAMERA_TRIGGER = 'CAM'
+
+# Arduino style micros() counters are 32 bit and wrap roughly every 71 minutes
+DEVICE_CLOCK_WRAP = 2 ** 32
+
+# Markers put on the same queue so a waiting race wakes up without polling.
+# A Disqualify with lane None disqualifies every lane still racing; PORT_CLOSED
+# means the port failed, or its reader was closed while a heat needed it.
+Disqualify = namedtuple('Disqualify', ['lane'])
+PORT_CLOSED = object()
+
+
+class SerialReader(threading.Thread):
+    def __init__(self, port, baudrate=9600, events=None):
+        super().__init__(name=f"SerialReader-{port}", daemon=True)
+        self.port = port
+        self.events = events if events is not None else queue.Queue()
+        self.running = True
+        # pyserial is only needed once a race uses the port
+        import serial
+        self.serial_error = serial.SerialException
+        # Opened here so a bad port is reported to the caller, not the thread
+        self.ser = serial.Serial(port, baudrate, timeout=1)
+
+    def run(self):
+        logging.info(f"Serial reader started on {self.port}")
+        while self.running:
+            try:
+                first = self.ser.read(1)
+                if not first:
+                    continue
+                # Stamp on the trigger byte, before waiting for the rest of the line
+                timestamp = time.perf_counter_ns()
+                raw = first if first == b'\n' else first + self.ser.readline()
+                # The rest of the line after the stamped trigger byte
+                instrumentation.record('serial.readline', time.perf_counter_ns() - timestamp)
+                instrumentation.count('serial.lines')
+            except self.serial_error as e:
+                logging.error(f"Serial reader on {self.port} failed: {str(e)}")
+                self.events.put(PORT_CLOSED)
+                break
+            event = parse_line(raw, timestamp)
+            if event is not None:
+                self.events.put(event)
+                log_event('serial', port=self.port, timestamp=event.timestamp, line=event.line,
+                          device_us=event.device_us, lane=event.lane)
+        self.running = False
+        self.ser.close()
+        logging.info(f"Serial reader on {self.port} stopped")
+
+    def stop(self, timeout=2.0):
+        # Returns once the port is closed, so it can be reopened straight away;
+        # on Windows a COM port is exclusive until then
+        self.running = False
+        if self.ident is None:
+            self.ser.close()
+            return
+        try:
+            # Wakes the blocking read instead of waiting out its timeout
+            self.ser.cancel_read()
+        except (AttributeError, self.serial_error, OSError):
+            pass
+        if self is not threading.current_thread():
+            self.join(timeout)
+
+
+def drain(events):
+    # Throw away anything received before the caller started listening
+    while True:
+        try:
+            events.get_nowait()
+        except queue.Empty:
+            return
+
+
+def parse_line(raw, timestamp):
+    line = raw.decode('utf-8', errors='ignore').strip()
+    if not line:
+        return None
+    value, _, counter = line.partition(',')
+    device_us = None
+    if counter:
+        try:
+            device_us = int(counter)
+        except ValueError:
+            logging.warning(f"Ignoring malformed device counter in serial line: {line}")
+    return SerialEvent(timestamp, value, device_us, parse_lane(value))
+
+
+def parse_lane(value):
+    if value == '1':
+        return 1
+    if value[:1] in ('L', 'l') and value[1:].isdigit():
+        return int(value[1:])
+    return None
+
+
+def start_marker(timestamp=None):
+    # Stands in for a trigger when a lap starts on GO rather than on a sensor pulse
+    return SerialEvent(time.perf_counter_ns() if timestamp is None else timestamp, '', None, None)
+
+
+def elapsed_seconds(start, end, use_device_clock=False):
+    if use_device_clock and start.device_us is not None and end.device_us is not None:
+        return ((end.device_us - start.device_us) % DEVICE_CLOCK_WRAP) / 1e6
+    return (end.timestamp - start.timestamp) / 1e9
@@ -0,0 +1,121 @@
+import os
+import json
+import threading
+import time
+import logging
+
+try:
+    import pty
+    import tty
+except ImportError:  # Windows has no pseudo terminals
+    pty = None
+
+
+class VirtualTrack:
+    # Stands in for the track controller: a pseudo terminal whose slave end can
+    # be opened like the real serial port and which replays (offset_seconds, line)
+    # pairs at their scripted times.
+    def __init__(self, script):
+        if pty is None:
+            raise RuntimeError("The virtual track needs a POSIX system with pseudo terminal support")
+        self.script = sorted(script)
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.start_ns = None
+        self.sent_ns = []
+        # CPU seconds the replay thread spent, so a benchmark can leave it out
+        self.cpu = 0.0
+        self.thread = None
+        self.running = False
+
+    def start(self, start_ns=None):
+        self.start_ns = start_ns if start_ns is not None else time.perf_counter_ns()
+        self.running = True
+        self.thread = threading.Thread(target=self.replay, name="VirtualTrack", daemon=True)
+        self.thread.start()
+
+    def replay(self):
+        try:
+            for offset, line in self.script:
+                deadline = self.start_ns + int(offset * 1e9)
+                remaining = (deadline - time.perf_counter_ns()) / 1e9
+                # Sleep most of the way, then spin for the last millisecond to hit the deadline
+                if remaining > 0.002:
+                    time.sleep(remaining - 0.001)
+                while time.perf_counter_ns() < deadline:
+                    pass
+                if not self.running:
+                    return
+                self.sent_ns.append(time.perf_counter_ns())
+                os.write(self.master, f"{line}\r\n".encode('utf-8'))
+            logging.debug(f"Virtual track replayed {len(self.script)} lines")
+        finally:
+            self.cpu = time.thread_time()
+
+    def wait(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def close(self):
+        self.running = False
+        self.wait(1)
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def lap_script(lap_times, first_crossing=0.5, line='1'):
+    # The car crosses the line once after GO, then once per completed lap
+    script = [(first_crossing, line)]
+    elapsed = first_crossing
+    for lap_time in lap_times:
+        elapsed += lap_time
+        script.append((elapsed, line))
+    return script
+
+
+def load_script(filename):
+    # Recorded streams are plain text: "<seconds since GO> <line>" per row, '#' starts a comment.
+    # A .jsonl file is read as an event log written with the event_log setting.
+    if filename.endswith('.jsonl'):
+        return load_event_log(filename)
+    script = []
+    with open(filename, 'r') as file:
+        for row in file:
+            row = row.split('#', 1)[0].strip()
+            if not row:
+                continue
+            offset, line = row.split(None, 1)
+            script.append((float(offset), line.strip()))
+    return script
+
+
+def load_event_log(filename, race=None):
+    # The serial lines of one race in an event log, timed from its GO until the
+    # next GO. Without a race id the first race in the log is used.
+    go = None
+    script = []
+    with open(filename, 'r') as file:
+        for row in file:
+            try:
+                record = json.loads(row)
+            except ValueError:
+                continue
+            if record.get('event') == 'go':
+                if go is not None:
+                    break
+                if race is None or record.get('race') == race:
+                    go = record['timestamp']
+            elif record.get('event') == 'serial' and go is not None and record['timestamp'] >= go:
+                line = record['line'] if record.get('device_us') is None else f"{record['line']},{record['device_us']}"
+                script.append(((record['timestamp'] - go) / 1e9, line))
+    if go is None:
+        raise ValueError(f"No race {race or ''} found in {filename}")
+    return script
+
+
+def expected_lap_times(script, line='1'):
+    # Ground truth for a race started at offset 0 whose first crossing is not a lap
+    crossings = [offset for offset, value in sorted(script) if value.split(',', 1)[0] == line]
+    lap_starts = [0.0] + crossings[1:-1]
+    return [end - start for start, end in zip(lap_starts, crossings[1:])]
@@ -0,0 +1,73 @@
+import os
+import threading
+import logging
+
+# 256 samples at 44.1 kHz is under 6 ms of output buffering
+MIXER_FREQUENCY = 44100
+MIXER_BUFFER = 256
+
+# Countdown and GO cues get a channel of their own so race announcements never delay them
+CUE_CHANNEL = 0
+EVENT_CHANNEL = 1
+RESERVED_CHANNELS = 2
+
+
+class SoundBank:
+    # Every WAV under the sounds folder decoded once, keyed like "countdown/GO"
+    def __init__(self, folder):
+        self.folder = folder
+        self.sounds = {}
+        self.channels = {}
+        # pygame and the decoded sounds are loaded after the window is up
+        self.loaded = threading.Event()
+
+    def load_in_background(self):
+        threading.Thread(target=self.load, name="SoundBankLoader", daemon=True).start()
+
+    def load(self):
+        os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+        import pygame
+
+        try:
+            self.init_mixer(pygame)
+            self.load_sounds(pygame)
+        except pygame.error as e:
+            logging.error(f"Failed to start the sound mixer: {str(e)}")
+        finally:
+            self.loaded.set()
+
+    def init_mixer(self, pygame):
+        pygame.mixer.init(frequency=MIXER_FREQUENCY, size=-16, channels=2, buffer=MIXER_BUFFER)
+        pygame.mixer.set_num_channels(max(8, RESERVED_CHANNELS))
+        pygame.mixer.set_reserved(RESERVED_CHANNELS)
+        self.channels = {CUE_CHANNEL: pygame.mixer.Channel(CUE_CHANNEL), EVENT_CHANNEL: pygame.mixer.Channel(EVENT_CHANNEL)}
+
+    def load_sounds(self, pygame):
+        for directory, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                name, extension = os.path.splitext(filename)
+                if extension.lower() != '.wav':
+                    continue
+                key = os.path.relpath(os.path.join(directory, name), self.folder).replace(os.sep, '/')
+                try:
+                    self.sounds[key] = pygame.mixer.Sound(os.path.join(directory, filename))
+                except pygame.error as e:
+                    logging.error(f"Failed to load sound {key}: {str(e)}")
+        logging.info(f"Loaded {len(self.sounds)} sounds from {self.folder}")
+
+    def play(self, name, wait=1.0):
+        # A countdown started straight after launch waits briefly for the loader
+        if not self.loaded.wait(wait):
+            raise KeyError(f"Sounds not loaded yet, skipped {name}")
+        sound = self.sounds.get(name)
+        if sound is None:
+            raise KeyError(f"No sound named {name}")
+        channel = self.channels[CUE_CHANNEL if name.startswith('countdown/') else EVENT_CHANNEL]
+        channel.play(sound)
+
+    def close(self):
+        self.sounds = {}
+        self.channels = {}
+        if self.loaded.is_set():
+            import pygame
+            pygame.mixer.quit()
@@ -0,0 +1,139 @@
+import os
+import json
+import queue
+import threading
+import time
+import bisect
+import logging
+from collections import deque
+
+import cv2
+import numpy as np
+
+RECORDINGS_FOLDER = 'recordings'
+# Written frames remembered for matching laps that arrive late, about ten
+# seconds at 60 fps
+WRITTEN_FRAMES_KEPT = 600
+
+
+class VideoRecorder(threading.Thread):
+    # Encodes the camera stream on its own thread. Frames wait in a bounded pool
+    # of preallocated buffers; when the encoder falls behind, frames are dropped
+    # by drop_policy ('drop-newest' or 'drop-oldest') and counted, and capture
+    # is never blocked. Lap events are matched to the nearest written frame and
+    # stored in a sidecar index next to the video.
+    def __init__(self, filename, frame_shape, fps, max_queue=60, drop_policy='drop-newest', fourcc='mp4v'):
+        super().__init__(name="VideoRecorder", daemon=True)
+        if drop_policy not in ('drop-newest', 'drop-oldest'):
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.filename = filename
+        self.index_filename = os.path.splitext(filename)[0] + '.laps.jsonl'
+        self.frame_shape = frame_shape
+        self.fps = fps
+        self.drop_policy = drop_policy
+        self.fourcc = fourcc
+        self.free = deque(np.empty(frame_shape, dtype=np.uint8) for _ in range(max_queue))
+        self.free_lock = threading.Lock()
+        self.filled = queue.Queue()
+        self.pending_laps = deque()
+        # (frame number, capture timestamp) of the most recently written frames
+        self.written = deque(maxlen=WRITTEN_FRAMES_KEPT)
+        self.running = True
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.laps_marked = 0
+
+    def __call__(self, frame, timestamp):
+        # Capture thread listener
+        if not self.running:
+            return
+        with self.free_lock:
+            buffer = self.free.popleft() if self.free else None
+        if buffer is None:
+            if self.drop_policy == 'drop-newest':
+                self.frames_dropped += 1
+                return
+            try:
+                buffer, _ = self.filled.get_nowait()
+            except queue.Empty:
+                # The encoder holds every buffer right now
+                self.frames_dropped += 1
+                return
+            self.frames_dropped += 1
+        np.copyto(buffer, frame)
+        self.filled.put((buffer, timestamp))
+
+    def on_lap(self, lap):
+        # Race thread listener; resolved to a frame number by the encoder thread,
+        # whether the crossing frame is already written or still to come
+        self.pending_laps.append(lap)
+
+    def run(self):
+        height, width = self.frame_shape[:2]
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        writer = cv2.VideoWriter(self.filename, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (width, height))
+        if not writer.isOpened():
+            logging.error(f"Failed to open video writer for {self.filename}")
+            self.running = False
+            return
+        logging.info(f"Recording to {self.filename} at {self.fps:.1f} fps")
+        with open(self.index_filename, 'a') as index:
+            while self.running or not self.filled.empty():
+                try:
+                    buffer, timestamp = self.filled.get(timeout=0.2)
+                except queue.Empty:
+                    # Laps can arrive after their frame, with nothing new to write
+                    self.mark_laps(index)
+                    continue
+                writer.write(buffer)
+                with self.free_lock:
+                    self.free.append(buffer)
+                self.written.append((self.frames_written, timestamp))
+                self.frames_written += 1
+                self.mark_laps(index)
+            # No later frame is coming, so laps still waiting take the nearest one written
+            self.mark_laps(index, final=True)
+        writer.release()
+        logging.info(f"Recording stopped: {self.frames_written} frames written, {self.frames_dropped} dropped")
+
+    def mark_laps(self, index, final=False):
+        # Each lap gets the written frame captured nearest to its crossing. A
+        # lap newer than the last written frame waits until a later frame is
+        # written, since that one may be nearer, unless this is the final pass
+        # before the index closes. With no frame written at all, a lap is
+        # recorded with frame None.
+        timestamps = None
+        while self.pending_laps and (final or (self.written and self.pending_laps[0].timestamp <= self.written[-1][1])):
+            lap = self.pending_laps.popleft()
+            frame = None
+            if self.written:
+                if timestamps is None:
+                    timestamps = [timestamp for _, timestamp in self.written]
+                position = bisect.bisect_left(timestamps, lap.timestamp)
+                if position > 0 and (position == len(timestamps) or
+                                     lap.timestamp - timestamps[position - 1] < timestamps[position] - lap.timestamp):
+                    position -= 1
+                frame = self.written[position][0]
+            record = {'race': lap.race_id, 'lane': lap.lane, 'driver': lap.driver, 'lap': lap.lap,
+                      'time': lap.lap_time, 'frame': frame, 'seconds': None if frame is None else frame / self.fps}
+            index.write(json.dumps(record) + "\n")
+            index.flush()
+            if frame is None:
+                logging.warning(f"Lap {lap.lap} of {lap.driver} had no recorded frame to mark")
+            else:
+                self.laps_marked += 1
+
+    def stop(self, timeout=5):
+        # Frames already queued are still written before the file is closed
+        self.running = False
+        self.join(timeout)
+
+
+def recording_filename():
+    return os.path.join(RECORDINGS_FOLDER, f"race_{time.strftime('%Y%m%d-%H%M%S')}.mp4")
+
+
+def load_lap_index(video_filename):
+    index_filename = os.path.splitext(video_filename)[0] + '.laps.jsonl'
+    with open(index_filename, 'r') as file:
+        return [json.loads(line) for line in file if line.strip()]
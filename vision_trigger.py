@@ -0,0 +1,60 @@
+import logging
+
+import numpy as np
+
+from serial_reader import SerialEvent, CAMERA_TRIGGER
+
+
+class FinishLineTrigger:
+    # Frame differencing on the finish line region only. Called on the capture
+    # thread for every frame, so all work happens in buffers allocated up front.
+    def __init__(self, roi, events, lane=1, pixel_threshold=40, trigger_fraction=0.08, release_fraction=0.03,
+                 background_rate=0.05, min_interval=0.3):
+        self.x, self.y, self.width, self.height = roi
+        self.events = events
+        self.lane = lane
+        # A pixel counts as changed when its summed BGR value moves by more than this
+        self.pixel_threshold = pixel_threshold * 3
+        self.trigger_fraction = trigger_fraction
+        self.release_fraction = release_fraction
+        self.background_rate = background_rate
+        self.min_interval_ns = int(min_interval * 1e9)
+
+        shape = (self.height, self.width)
+        self.current = np.empty(shape, dtype=np.float32)
+        self.background = None
+        self.difference = np.empty(shape, dtype=np.float32)
+        self.changed = np.empty(shape, dtype=bool)
+        self.pixel_count = self.width * self.height
+
+        self.armed = True
+        self.last_trigger = None
+        self.triggers = 0
+
+    def __call__(self, frame, timestamp):
+        region = frame[self.y:self.y + self.height, self.x:self.x + self.width]
+        np.sum(region, axis=2, dtype=np.float32, out=self.current)
+        if self.background is None:
+            self.background = self.current.copy()
+            return
+
+        np.subtract(self.current, self.background, out=self.difference)
+        np.abs(self.difference, out=self.difference)
+        np.greater(self.difference, self.pixel_threshold, out=self.changed)
+        fraction = np.count_nonzero(self.changed) / self.pixel_count
+
+        if self.armed and fraction >= self.trigger_fraction:
+            if self.last_trigger is None or timestamp - self.last_trigger >= self.min_interval_ns:
+                self.armed = False
+                self.last_trigger = timestamp
+                self.triggers += 1
+                self.events.put(SerialEvent(timestamp, CAMERA_TRIGGER, None, self.lane))
+                logging.debug(f"Camera trigger in lane {self.lane} ({fraction:.0%} of the line changed)")
+        elif not self.armed and fraction <= self.release_fraction:
+            self.armed = True
+
+        if self.armed:
+            # Follow slow lighting changes, but never learn the car itself as background
+            self.background *= 1 - self.background_rate
+            np.multiply(self.current, self.background_rate, out=self.difference)
+            self.background += self.difference